@@ -3,6 +3,66 @@ from scripts import oed
 import os
 import json
 import numpy as np
+from typing import NamedTuple
+
+
+# 遺伝子の改変の方法 (改変前の値, 改変に使う値) -> 改変後の値
+OPERATIONS = {
+    "add": np.add,
+    "subtract": np.subtract,
+    "multiply": np.multiply,
+    "set": lambda gene, value: np.broadcast_to(value, gene.shape),
+}
+
+
+class Perturbation(NamedTuple):
+    """
+    遺伝子の改変の1つの軸
+    indices: 改変する遺伝子の番号のリスト
+    op: 改変の方法（"add", "subtract", "multiply", "set"）
+    values: 改変に使う値の列（np.linspace(start, stop, num + 1)など）
+    clip: 改変後の値の範囲（Noneの場合はクリップしない）
+    """
+
+    indices: tuple
+    op: str
+    values: np.ndarray
+    clip: tuple = (-1, 1)
+
+
+def compile_sweep(base_gene, axes):
+    """
+    base_gene: 改変前の遺伝子
+    axes: Perturbationのリスト（複数の場合はすべての値の組み合わせをとる）
+
+    改変に使う値の組 (num_points, len(axes)) と改変した遺伝子 (num_points, 22) を返す
+    """
+    grids = np.meshgrid(
+        *[np.asarray(axis.values, float) for axis in axes], indexing="ij"
+    )
+    values = np.stack([grid.reshape(-1) for grid in grids], axis=-1)
+    genes = np.tile(np.asarray(base_gene, float), (len(values), 1))
+    for k, axis in enumerate(axes):
+        index = list(axis.indices)
+        changed = OPERATIONS[axis.op](genes[:, index], values[:, k : k + 1])
+        if axis.clip is not None:
+            changed = np.clip(changed, *axis.clip)
+        genes[:, index] = changed
+    return values, genes
+
+
+def sweep_result(values, genes):
+    """
+    compile_sweepの結果を {"value", "gene"} のリスト（JSONに書き出す形式）にする
+    軸が1つの場合はvalueを数値，複数の場合はリストにする
+    """
+    return [
+        {
+            "value": float(value[0]) if len(value) == 1 else value.tolist(),
+            "gene": gene.tolist(),
+        }
+        for value, gene in zip(values, genes)
+    ]
 
 
 def gene_aser_aiy_synapse_change(
@@ -18,15 +78,11 @@ def gene_aser_aiy_synapse_change(
     """
 
     result = load.load_result_json(gene_path)
-    base_gene = np.array(result[gene_number]["gene"])
-
-    change_result = []
-    for delta_gene in np.linspace(start, stop, num + 1):
-        zero_gene = np.zeros_like(base_gene)
-        zero_gene[10:12] = [delta_gene] * 2
-        change_gene = base_gene + zero_gene
-        change_gene = np.clip(change_gene, -1, 1)
-        change_result.append({"value": delta_gene, "gene": change_gene.tolist()})
+    values, genes = compile_sweep(
+        result[gene_number]["gene"],
+        [Perturbation((10, 11), "add", np.linspace(start, stop, num + 1))],
+    )
+    change_result = sweep_result(values, genes)
 
     json_data = json.dumps(change_result, indent=1)
     os.makedirs("../result/concentration_memory", exist_ok=True)
@@ -38,6 +94,8 @@ def gene_aser_aiy_synapse_change(
     ) as json_file:
         json_file.write(json_data)
 
+    return change_result
+
 
 def gene_ase_aiy_synapse_change(
     gene_number, start, stop, num, gene_path="../result/Result_aiy_aiz_negative.json"
@@ -52,15 +110,11 @@ def gene_ase_aiy_synapse_change(
     """
 
     result = load.load_result_json(gene_path)
-    base_gene = np.array(result[gene_number]["gene"])
-
-    change_result = []
-    for delta_gene in np.linspace(start, stop, num + 1):
-        zero_gene = np.zeros_like(base_gene)
-        zero_gene[8:12] = [delta_gene] * 4
-        change_gene = base_gene + zero_gene
-        change_gene = np.clip(change_gene, -1, 1)
-        change_result.append({"value": delta_gene, "gene": change_gene.tolist()})
+    values, genes = compile_sweep(
+        result[gene_number]["gene"],
+        [Perturbation((8, 9, 10, 11), "add", np.linspace(start, stop, num + 1))],
+    )
+    change_result = sweep_result(values, genes)
 
     json_data = json.dumps(change_result, indent=1)
     os.makedirs("../result/concentration_memory", exist_ok=True)
@@ -72,6 +126,8 @@ def gene_ase_aiy_synapse_change(
     ) as json_file:
         json_file.write(json_data)
 
+    return change_result
+
 
 def gene_asel_aiy_delete(
     gene_number,
@@ -87,15 +143,13 @@ def gene_asel_aiy_delete(
     gene_path: 遺伝子が保存されているJSONファイルのpathのリスト[制約無しモデル，制約ありモデル，低塩濃度モデル]
     """
 
-    base_gene = []
+    change_result = []
     for path in gene_path:
         result = load.load_result_json(path)
-        base_gene.append(result[gene_number]["gene"])
-
-    change_result = []
-    for gene in base_gene:
-        gene[8:10] = [0.0] * 2
-        change_result.append({"value": 0.0, "gene": gene})
+        values, genes = compile_sweep(
+            result[gene_number]["gene"], [Perturbation((8, 9), "set", [0.0])]
+        )
+        change_result += sweep_result(values, genes)
 
     json_data = json.dumps(change_result, indent=1)
     os.makedirs("../result/newron_deletion", exist_ok=True)
@@ -105,6 +159,8 @@ def gene_asel_aiy_delete(
     ) as json_file:
         json_file.write(json_data)
 
+    return change_result
+
 
 def gene_aiz_smb_synapse_change(
     gene_number=[0, 9, 15],
@@ -114,22 +170,18 @@ def gene_aiz_smb_synapse_change(
     """
     AIZ-SMBのシナプス特性を変化させる。
     gene_number: 改変する遺伝子の番号[高塩濃度, 中間, 低塩濃度]
-    scaling: 14,15の結合(AIZ-SMB)に対してかける値
+    scaling: 14,15,16,17の結合(AIZ-SMB)に対してかける値（valueとして保存する）
     gene_path: 遺伝子が保存されているJSONファイルのpath
     """
 
     result = load.load_result_json(gene_path)
-    base_gene = []
-    for i in gene_number:
-        base_gene.append(result[i]["gene"])
-
     change_result = []
-    for gene in base_gene:
-        gene[14] *= scaling
-        gene[15] *= scaling
-        gene[16] *= scaling
-        gene[17] *= scaling
-        change_result.append({"value": 0.0, "gene": gene})
+    for i in gene_number:
+        values, genes = compile_sweep(
+            result[i]["gene"],
+            [Perturbation((14, 15, 16, 17), "multiply", [scaling], clip=None)],
+        )
+        change_result += sweep_result(values, genes)
 
     json_data = json.dumps(change_result, indent=1)
     os.makedirs("../result/starvation/synapse", exist_ok=True)
@@ -139,6 +191,8 @@ def gene_aiz_smb_synapse_change(
     ) as json_file:
         json_file.write(json_data)
 
+    return change_result
+
 
 def gene_aiz_smb_synapse_gradually_change(
     gene_number, start, stop, num, gene_path="../result/Result_aiy_aiz_negative.json"
@@ -153,15 +207,11 @@ def gene_aiz_smb_synapse_gradually_change(
     """
 
     result = load.load_result_json(gene_path)
-    base_gene = np.array(result[gene_number]["gene"])
-
-    change_result = []
-    for delta_gene in np.linspace(start, stop, num + 1):
-        one_gene = np.ones_like(base_gene)
-        one_gene[14:16] = [delta_gene] * 2
-        change_gene = base_gene * one_gene
-        change_gene = np.clip(change_gene, -1, 1)
-        change_result.append({"value": delta_gene, "gene": change_gene.tolist()})
+    values, genes = compile_sweep(
+        result[gene_number]["gene"],
+        [Perturbation((14, 15), "multiply", np.linspace(start, stop, num + 1))],
+    )
+    change_result = sweep_result(values, genes)
 
     json_data = json.dumps(change_result, indent=1)
     os.makedirs("../result/starvation/synapse", exist_ok=True)
@@ -173,6 +223,8 @@ def gene_aiz_smb_synapse_gradually_change(
     ) as json_file:
         json_file.write(json_data)
 
+    return change_result
+
 
 def gene_smb_bias_change(
     gene_number=[0, 9, 15],
@@ -182,19 +234,17 @@ def gene_smb_bias_change(
     """
     SMBのバイアスを変化させる。
     gene_number: 改変する遺伝子の番号[高塩濃度, 中間, 低塩濃度]
-    scaling: 6,7のバイアス(SMB)に対して引く値
+    scaling: 6,7のバイアス(SMB)に対して引く値（valueとして保存する）
     gene_path: 遺伝子が保存されているJSONファイルのpath
     """
     result = load.load_result_json(gene_path)
-    base_gene = []
-    for i in gene_number:
-        base_gene.append(result[i]["gene"])
-
     change_result = []
-    for gene in base_gene:
-        gene[6] -= scaling
-        gene[7] -= scaling
-        change_result.append({"value": 0.0, "gene": gene})
+    for i in gene_number:
+        values, genes = compile_sweep(
+            result[i]["gene"],
+            [Perturbation((6, 7), "subtract", [scaling], clip=None)],
+        )
+        change_result += sweep_result(values, genes)
 
     json_data = json.dumps(change_result, indent=1)
     os.makedirs("../result/starvation/bias", exist_ok=True)
@@ -204,6 +254,8 @@ def gene_smb_bias_change(
     ) as json_file:
         json_file.write(json_data)
 
+    return change_result
+
 
 def gene_smb_bias_gradually_change(
     gene_number, start, stop, num, gene_path="../result/Result_aiy_aiz_negative.json"
@@ -218,15 +270,11 @@ def gene_smb_bias_gradually_change(
     """
 
     result = load.load_result_json(gene_path)
-    base_gene = np.array(result[gene_number]["gene"])
-
-    change_result = []
-    for delta_gene in np.linspace(start, stop, num + 1):
-        zero_gene = np.zeros_like(base_gene)
-        zero_gene[6:8] = [delta_gene] * 2
-        change_gene = base_gene - zero_gene
-        change_gene = np.clip(change_gene, -1, 1)
-        change_result.append({"value": delta_gene, "gene": change_gene.tolist()})
+    values, genes = compile_sweep(
+        result[gene_number]["gene"],
+        [Perturbation((6, 7), "subtract", np.linspace(start, stop, num + 1))],
+    )
+    change_result = sweep_result(values, genes)
 
     json_data = json.dumps(change_result, indent=1)
     os.makedirs("../result/starvation/bias", exist_ok=True)
@@ -236,13 +284,110 @@ def gene_smb_bias_gradually_change(
     ) as json_file:
         json_file.write(json_data)
 
+    return change_result
 
-def parameter_output_latex(gene, decimal_places):
-    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = oed.weight(gene)
-    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = [
-        np.round(var, decimal_places)
-        for var in [N, M, theta, w_on, w_off, w, g, w_osc, w_nmj]
+
+def run_sweeps(sweeps, c_mode, n_worms, out_path=None, seed=None, axis_names=None):
+    """
+    sweeps: {名前: 改変した遺伝子のリスト} の辞書
+            （各gene_*_change関数の戻り値，またはそれらが書き出したJSONの内容）
+    c_mode: 濃度関数の種類
+    n_worms: 改変した遺伝子ごとに平均をとるワームの数
+    out_path: 結果の表を書き出すファイルのパス（Noneの場合は書き出さない）
+    seed: 乱数のシード
+    axis_names: 改変の軸の名前のリスト（ヘッダーに書き出す，Noneの場合は
+                軸が1つなら"value"，複数なら"value_0", "value_1", ...）
+
+    すべての(改変した遺伝子, ワーム)の組を1つのキューで並列に計算する
+    ワームのCIは計算が終わるたびに「スイープの番号, 遺伝子の番号, 各軸のvalue, ワームの番号,
+    CI」の1行として書き出し，改変した遺伝子ごとのCIの平均などの表（辞書のリスト）を返す
+    （軸の少ないスイープの足りない列はnanとし，load.load_output_txtで読み込める）
+    使用例：
+    sweeps = {
+        "aser_aiy_0": analysis.gene_aser_aiy_synapse_change(0, 0, 1, 20),
+        "smb_bias_0": analysis.gene_smb_bias_gradually_change(0, 0, 0.1, 20),
+    }
+    analysis.run_sweeps(sweeps, 1, 100, "../result/sweep/ci.txt")
+
+    2次元の感度マップの例（ASER-AIYとSMBのバイアスのすべての組み合わせ）：
+    values, genes = analysis.compile_sweep(
+        base_gene,
+        [
+            analysis.Perturbation((10, 11), "add", np.linspace(0, 1, 21)),
+            analysis.Perturbation((6, 7), "subtract", np.linspace(0, 0.1, 21)),
+        ],
+    )
+    analysis.run_sweeps(
+        {"map": analysis.sweep_result(values, genes)},
+        1,
+        100,
+        "../result/sweep/map.txt",
+        axis_names=["aser_aiy", "smb_bias"],
+    )
+    """
+    names = list(sweeps)
+    entries = [
+        (sweep, i, change_result)
+        for sweep, name in enumerate(names)
+        for i, change_result in enumerate(sweeps[name])
     ]
+    genes = [change_result["gene"] for _, _, change_result in entries]
+    stats = [oed.RunningCI() for _ in entries]
+
+    # 軸が複数のvalueはリストなので，軸ごとの数値の列として書き出す
+    axis_values = [
+        np.atleast_1d(np.asarray(change_result["value"], dtype=float))
+        for _, _, change_result in entries
+    ]
+    n_axes = max((len(value) for value in axis_values), default=1)
+    if axis_names is None:
+        axis_names = ["value"] if n_axes == 1 else [f"value_{j}" for j in range(n_axes)]
+    if len(axis_names) != n_axes:
+        raise ValueError(f"axis_names must have {n_axes} names")
+    columns = [
+        ", ".join(
+            str(v)
+            for v in np.pad(value, (0, n_axes - len(value)), constant_values=np.nan)
+        )
+        for value in axis_values
+    ]
+
+    txt_file = None
+    if out_path is not None:
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        txt_file = open(out_path, "w")
+        for sweep, name in enumerate(names):
+            txt_file.write(f"# sweep {sweep}: {name}\n")
+        txt_file.write(f"# sweep, index, {', '.join(axis_names)}, worm, ci\n")
+
+    try:
+        for k, worm, value in oed.ci_stream(genes, c_mode, n_worms, seed):
+            stats[k].update(value)
+            if txt_file is not None:
+                sweep, i, change_result = entries[k]
+                txt_file.write(f"{sweep}, {i}, {columns[k]}, {worm}, {value}\n")
+                txt_file.flush()
+    finally:
+        if txt_file is not None:
+            txt_file.close()
+
+    return [
+        {
+            "sweep": names[sweep],
+            "index": i,
+            "value": change_result["value"],
+            "mean": stats[k].mean,
+            "std": stats[k].std,
+            "se": stats[k].se,
+        }
+        for k, (sweep, i, change_result) in enumerate(entries)
+    ]
+
+
+def parameter_output_latex(gene, decimal_places):
+    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = oed.decode(
+        gene, decimal_places
+    ).weights
 
     name = [
         "AIYL",
@@ -1,5 +1,4 @@
 import numpy as np
-import multiprocessing
 import matplotlib.pyplot as plt
 from matplotlib.collections import LineCollection
 from matplotlib.offsetbox import OffsetImage, AnnotationBbox
@@ -8,14 +7,12 @@ from matplotlib import animation
 from PIL import Image, ImageOps
 from scripts import oed
 from scripts import figure
+from scripts import executor
+from scripts import cache
+from scripts import tasks
 import time as tm
 
 
-def calculate_trajectory(gene_angle_list):
-    gene, angle, c_mode = gene_angle_list
-    return oed.klinotaxis_animation(gene, angle, c_mode)
-
-
 def compute_concentration_map(x_range, y_range, c_mode):
     """指定されたxおよびy範囲に対する濃度関数を計算します。"""
     alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = oed.constant(
@@ -61,32 +58,28 @@ def single_trajectory_animation(
     padding=1,
     figsize=(10, 4),
     fontsize=14,
+    seed=None,
 ):
     """
     遺伝子の軌跡アニメーションを作成し、保存します。
+    seedを指定した場合は計算した軌跡をキャッシュし，再作成時に使い回します。
     使用例：
     result = load.load_result_json("../result/Result_aiy_aiz_negative.json")
     gene = result[0]["gene"]
     animation.single_trajectory_animation(gene)
     """
-    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = oed.constant(
-        "setting_animation"
-    )
+    setting = oed.constant("setting_animation")
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
     fig, ax = plt.subplots(figsize=figsize)
 
-    # 並列計算のためのプロセス数を決定
-    process = min(lines_number, multiprocessing.cpu_count())
     gene_angle_list = [
-        [gene, angle, c_mode]
-        for angle in np.arange(0, 2 * np.pi, 2 * np.pi / lines_number)
+        [gene, angle, c_mode, setting, downsample_factor, cache.line_seed(seed, i)]
+        for i, angle in enumerate(np.arange(0, 2 * np.pi, 2 * np.pi / lines_number))
     ]
 
-    # 遺伝子の軌跡を並列で計算
-    with multiprocessing.Pool(process) as pool:
-        results = pool.map(calculate_trajectory, gene_angle_list)
+    # 遺伝子の軌跡を共有のプロセスプールで並列に計算
+    results = executor.map(tasks.calculate_animation_trajectory, gene_angle_list)
 
-    # 結果をダウンサンプル
-    results = [[b[::downsample_factor] for b in a] for a in results]
     all_lines = []
     for r in results:
         lines = figure.single_line_stacks(r[0], r[1])
@@ -208,7 +201,7 @@ def single_trajectory_animation(
                 prev_length = prev_lengths[i]
                 current_length = min(len(lines), frame * skip + 1)
                 new_segments = lines[prev_length:current_length]
-                if new_segments:
+                if len(new_segments) > 0:
                     segments = list(line_collections[i].get_segments())
                     segments.extend(new_segments)
                     line_collections[i].set_segments(segments)
@@ -322,9 +315,11 @@ def dual_trajectory_animation(
     padding=1,
     figsize=(10, 8),
     fontsize=14,
+    seed=None,
 ):
     """
     遺伝子の軌跡アニメーションを作成し、保存します。
+    seedを指定した場合は計算した軌跡をキャッシュし，再作成時に使い回します。
     使用例：
     result_1 = load.load_result_json("../result/Result_aiy_aiz_negative.json")
     result_2 = load.load_result_json(
@@ -335,25 +330,17 @@ def dual_trajectory_animation(
     animation.dual_trajectory_animation(gene_1, gene_2)
     """
     # 定数の取得
-    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = oed.constant(
-        "setting_animation"
-    )
-
-    # マルチプロセスのためのプロセス数設定
-    process = min(lines_number, multiprocessing.cpu_count())
+    setting = oed.constant("setting_animation")
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
 
     def calculate_lines(gene):
         # 遺伝子の角度ごとのトラジェクトリを計算
         gene_angle_list = [
-            [gene, angle, c_mode]
-            for angle in np.arange(0, 2 * np.pi, 2 * np.pi / lines_number)
+            [gene, angle, c_mode, setting, downsample_factor, cache.line_seed(seed, i)]
+            for i, angle in enumerate(np.arange(0, 2 * np.pi, 2 * np.pi / lines_number))
         ]
 
-        with multiprocessing.Pool(process) as pool:
-            results = pool.map(calculate_trajectory, gene_angle_list)
-
-        # データの間引き
-        results = [[b[::downsample_factor] for b in a] for a in results]
+        results = executor.map(tasks.calculate_animation_trajectory, gene_angle_list)
 
         all_lines = [figure.single_line_stacks(r[0], r[1]) for r in results]
         return all_lines
@@ -492,7 +479,7 @@ def dual_trajectory_animation(
                 prev_length = prev_lengths[i]
                 current_length = min(len(lines), frame * skip + 1)
                 new_segments = lines[prev_length:current_length]
-                if new_segments:
+                if len(new_segments) > 0:
                     segments = list(line_collections[i].get_segments())
                     segments.extend(new_segments)
                     line_collections[i].set_segments(segments)
@@ -0,0 +1,295 @@
+from scripts import oed
+from scripts import load
+from scripts import cache
+from scripts import executor
+from scripts import tasks
+import numpy as np
+import time as tm
+import glob
+import os
+
+
+def time_klinotaxis(gene, c_mode, jit, repeat, setting=None, seed=None):
+    """
+    gene: 遺伝子
+    c_mode: 濃度関数の種類
+    jit: コンパイル済みカーネルを使用するかどうか
+    repeat: 計測の繰り返し回数
+    setting: 設定（Noneの場合は"setting"セクションを読み込む）
+    seed: 乱数のシード
+
+    ワーム1匹あたりのklinotaxisの計算時間（最小値）を返す
+    """
+    rng = np.random.default_rng(seed)
+    times = []
+    for i in range(repeat):
+        mu_0 = rng.uniform(0, 2 * np.pi)
+        start_time = tm.perf_counter()
+        oed.klinotaxis(gene, mu_0, c_mode, jit=jit, setting=setting, seed=rng)
+        times.append(tm.perf_counter() - start_time)
+    return min(times)
+
+
+def klinotaxis_speedup(gene, c_mode=1, repeat=3, setting=None):
+    """
+    gene: 遺伝子
+    c_mode: 濃度関数の種類
+    repeat: 計測の繰り返し回数
+    setting: 設定（短い時間で計測する場合は
+             oed.constant("setting")._replace(time=10) などを渡す）
+
+    NumPyによる実装とコンパイル済みカーネルのワーム1匹あたりの計算時間を比較する
+    使用例：
+    result = load.load_result_json("../data/gene/Result.json")
+    benchmark.klinotaxis_speedup(result[0]["gene"])
+    """
+    numpy_time = time_klinotaxis(gene, c_mode, False, repeat, setting)
+    print(f"NumPy: {numpy_time:.2f} seconds per worm")
+
+    if not oed.use_jit():
+        print("numba is not installed")
+        return numpy_time, None, None
+
+    # 初回呼び出しのコンパイル時間を除く
+    oed.klinotaxis(gene, 0, c_mode, jit=True, setting=setting)
+    jit_time = time_klinotaxis(gene, c_mode, True, repeat, setting)
+    speedup = numpy_time / jit_time
+    print(f"numba: {jit_time:.2f} seconds per worm ({speedup:.1f}x)")
+
+    return numpy_time, jit_time, speedup
+
+
+def integrator_convergence(
+    gene,
+    c_mode=1,
+    methods=("euler", "rk4", "exponential_euler"),
+    dts=(0.001, 0.002, 0.005, 0.01, 0.02),
+    worms=10,
+    reference_dt=0.0001,
+    setting=None,
+    seed=0,
+    jit=None,
+):
+    """
+    gene: 遺伝子
+    c_mode: 濃度関数の種類
+    methods: 比較する積分法（oed.simulateのmethod，"adaptive"を加えた場合はdtを記録の間隔とする）
+    dts: 比較する時間刻み（reference_dtの整数倍）
+    worms: 比較するワームの数
+    reference_dt: 基準とするオイラー法の時間刻み（従来のdt=0.001のオイラー法の誤差も
+                  表に含めるため，それより細かくする）
+    setting: 設定（Noneの場合は"setting"セクションを読み込む，短い時間で計算する場合は
+             oed.constant("setting")._replace(time=50) などを渡す）
+    seed: 乱数のシード（初期角度と運動ニューロンの初期値をすべての計算で揃える）
+    jit: コンパイル済みカーネルを使用するかどうか（"adaptive"は使用しない）
+
+    dt=reference_dtのオイラー法を基準として，積分法と時間刻みごとに
+    CIの誤差（ワームごとの差の絶対値の平均），軌跡の誤差（共通の時刻での距離のRMS），
+    終点の誤差（最後の共通の時刻での距離）をワームで平均し，計算時間とともに表示する
+    計算時間にはコンパイル時間を含めない
+    結果を辞書のリストで返す
+    使用例：
+    result = load.load_result_json("../data/gene/Result.json")
+    benchmark.integrator_convergence(result[0]["gene"])
+    """
+    if setting is None:
+        setting = oed.constant("setting")
+    mu_0 = np.random.default_rng(seed).uniform(0, 2 * np.pi, worms)
+
+    def run(method, dt):
+        start_time = tm.perf_counter()
+        r, ci = oed.simulate(
+            gene,
+            mu_0,
+            c_mode,
+            [oed.PositionRecorder(), oed.CIRecorder()],
+            jit=jit,
+            setting=setting._replace(dt=dt),
+            seed=seed,
+            method=method,
+        )
+        return r, ci, tm.perf_counter() - start_time
+
+    # コンパイル時間を計測に含めない
+    short = setting._replace(time=10 * max(dts))
+    for method in {"euler", *methods}:
+        oed.simulate(
+            gene,
+            mu_0,
+            c_mode,
+            [oed.CIRecorder()],
+            jit=jit,
+            setting=short,
+            method=method,
+        )
+
+    r_ref, ci_ref, _ = run("euler", reference_dt)
+
+    report = []
+    print("method             dt      CI error   trajectory  endpoint   seconds/worm")
+    for method in methods:
+        for dt in dts:
+            ratio = int(round(dt / reference_dt))
+            if not np.isclose(ratio * reference_dt, dt):
+                raise ValueError(f"dt={dt} is not a multiple of {reference_dt}")
+            r, ci, seconds = run(method, dt)
+
+            # 同じ時刻の位置どうしを比べる
+            length = min(r.shape[2], -(-r_ref.shape[2] // ratio))
+            distance = np.linalg.norm(
+                r[:, :, :length] - r_ref[:, :, : length * ratio : ratio], axis=1
+            )
+            row = {
+                "method": method,
+                "dt": dt,
+                "ci_error": np.mean(np.abs(ci - ci_ref)),
+                "trajectory_error": np.mean(np.sqrt(np.mean(distance**2, axis=1))),
+                "endpoint_error": np.mean(distance[:, -1]),
+                "seconds": seconds / worms,
+            }
+            report.append(row)
+            print(
+                f"{method:18} {dt:<7g} {row['ci_error']:<10.2e} "
+                f"{row['trajectory_error']:<11.2e} {row['endpoint_error']:<10.2e} "
+                f"{row['seconds']:.3f}"
+            )
+
+    return report
+
+
+def validate_float32(
+    pattern="../data/gene/*.json",
+    c_mode=1,
+    genes_per_file=1,
+    worms=100,
+    setting=None,
+    seed=0,
+    jit=None,
+):
+    """
+    pattern: 遺伝子のjsonファイルのパターン
+    c_mode: 濃度関数の種類
+    genes_per_file: 各ファイルの先頭から比較する遺伝子の数
+    worms: 遺伝子ごとのワームの数
+    setting: 設定（Noneの場合は"setting"セクションを読み込む）
+    seed: 乱数のシード（初期角度と運動ニューロンの初期値を両方の計算で揃える）
+    jit: コンパイル済みカーネルを使用するかどうか
+
+    同じ初期条件のワームをfloat64とfloat32で計算し，遺伝子ごとに
+    CIの平均，CIの差の絶対値の最大値，終点の距離の平均と最大値，計算時間の比を表示する
+    結果を辞書のリストで返す
+    使用例：
+    benchmark.validate_float32(worms=1000)
+    """
+    if setting is None:
+        setting = oed.constant("setting")
+    mu_0 = np.random.default_rng(seed).uniform(0, 2 * np.pi, worms)
+
+    def run(gene, dtype, setting=setting):
+        start_time = tm.perf_counter()
+        ci, endpoint = oed.simulate(
+            gene,
+            mu_0,
+            c_mode,
+            [oed.CIRecorder(), oed.EndpointRecorder()],
+            jit=jit,
+            setting=setting,
+            seed=seed,
+            dtype=dtype,
+        )
+        return ci, endpoint, tm.perf_counter() - start_time
+
+    # 計測と同じ引数で型ごとに1度ずつ計算し，コンパイルや初回の読み込みの時間を
+    # 計測に含めない
+    short = setting._replace(time=10 * setting.dt)
+    for dtype in [np.float64, np.float32]:
+        run(np.zeros(22), dtype, short)
+
+    report = []
+    print(
+        "file                              index  CI(64)   CI(32)   |dCI|max  "
+        "endpoint mean/max  time 32/64"
+    )
+    for path in sorted(glob.glob(pattern)):
+        for index, gene_result in enumerate(
+            load.load_result_json(path)[:genes_per_file]
+        ):
+            ci_64, endpoint_64, time_64 = run(gene_result["gene"], np.float64)
+            ci_32, endpoint_32, time_32 = run(gene_result["gene"], np.float32)
+            distance = np.linalg.norm(endpoint_32 - endpoint_64, axis=1)
+            row = {
+                "file": os.path.basename(path),
+                "index": index,
+                "ci_64": np.mean(ci_64),
+                "ci_32": np.mean(ci_32),
+                "ci_error_max": np.max(np.abs(ci_32 - ci_64)),
+                "endpoint_error_mean": np.mean(distance),
+                "endpoint_error_max": np.max(distance),
+                "time_ratio": time_32 / time_64,
+            }
+            report.append(row)
+            print(
+                f"{row['file']:33} {index:<6} {row['ci_64']:<8.4f} {row['ci_32']:<8.4f} "
+                f"{row['ci_error_max']:<9.2e} {row['endpoint_error_mean']:.2e}/"
+                f"{row['endpoint_error_max']:.2e}  {row['time_ratio']:.2f}"
+            )
+
+    return report
+
+
+def validate_shared_trajectory(gene, c_mode=1, lines_number=None, setting=None, seed=0):
+    """
+    gene: 遺伝子
+    c_mode: 濃度関数の種類
+    lines_number: 軌跡の数（Noneの場合はワーカー数の4倍+1，Pool.mapが1つのチャンクに
+                  複数のタスクをまとめる数にする）
+    setting: 設定（Noneの場合は"setting"セクションを読み込む，短い時間で計算する場合は
+             oed.constant("setting")._replace(time=10) などを渡す）
+    seed: 乱数のシード（計算した軌跡はキャッシュに保存される）
+
+    figure.trajectory, figure.trajectory_membrane_potentialと同じ方法で
+    共有メモリ（executor.SharedArray）に軌跡を並列に書き込み，
+    1匹ずつ計算した結果と一致するかを確かめる
+    すべての軌跡が一致した場合はTrueを返す
+    使用例：
+    result = load.load_result_json("../data/gene/Result.json")
+    benchmark.validate_shared_trajectory(result[0]["gene"])
+    """
+    if setting is None:
+        setting = oed.constant("setting")
+    if lines_number is None:
+        executor.get_pool()
+        lines_number = 4 * executor._process + 1
+    angles = np.arange(0, 2 * np.pi, 2 * np.pi / lines_number)
+    seeds = [cache.line_seed(seed, i) for i in range(lines_number)]
+    steps = len(np.arange(0, setting.time, setting.dt))
+
+    with executor.SharedArray((lines_number, 2, steps)) as shared:
+        executor.map(
+            tasks.calculate_trajectory,
+            [
+                [gene, angle, c_mode, None, setting, seeds[i], shared, i]
+                for i, angle in enumerate(angles)
+            ],
+        )
+        trajectory = shared.array.copy()
+    with executor.SharedArray((lines_number, 4, steps)) as shared:
+        executor.map(
+            tasks.calculate_trajectory_membrane_potential,
+            [
+                [gene, angle, c_mode, setting, seeds[i], shared, i]
+                for i, angle in enumerate(angles)
+            ],
+        )
+        membrane_potential = shared.array.copy()
+
+    mismatch = []
+    for i, angle in enumerate(angles):
+        r = oed.klinotaxis(gene, angle, c_mode, setting=setting, seed=seeds[i])
+        if not (
+            np.array_equal(trajectory[i], r)
+            and np.array_equal(membrane_potential[i, 0:2], r)
+        ):
+            mismatch.append(i)
+    print(f"lines: {lines_number}, mismatched lines: {mismatch}")
+    return not mismatch
@@ -0,0 +1,258 @@
+import hashlib
+import os
+import zipfile
+import numpy as np
+from scripts import oed
+
+# 軌跡を保存するディレクトリ（SETTING_PATHと同じくscriptsからの相対パス）
+CACHE_DIR = "../cache/trajectory"
+# キャッシュの合計サイズの上限（バイト），超えた分は古いものから削除する
+# 膜電位は1本あたり圧縮後でも約24 MB（350秒, dt=0.001）あるため，
+# 100本の膜電位の図（軌跡と合わせて約3 GB）が実行中に自身の結果を消さない大きさにする
+max_bytes = 4 * 2**30
+
+
+def cacheable_seed(seed):
+    """
+    seed: 乱数のシード
+
+    結果を再現できるシード（int または SeedSequence）かどうかを返す
+    Noneや使うたびに状態の変わるGeneratorの結果はキャッシュしない
+    """
+    return isinstance(seed, (int, np.integer, np.random.SeedSequence))
+
+
+def cache_key(
+    kind,
+    gene,
+    mu_0,
+    c_mode,
+    setting,
+    seed,
+    decimal_places,
+    stride=1,
+    pirouette=False,
+    jit=None,
+    method="euler",
+    tolerance=1e-6,
+    max_dt=None,
+    dtype=np.float64,
+):
+    """
+    kind: 保存する結果の種類（"klinotaxis"など）
+    gene: 遺伝子
+    mu_0: 初期角度
+    c_mode: 濃度関数の種類
+    setting: 設定
+    seed: 乱数のシード（int または SeedSequence）
+    decimal_places: パラメータを丸める小数点以下の桁数
+    stride: 記録の間隔
+    pirouette, jit, method, tolerance, max_dt, dtype: oed.simulateの引数
+
+    計算結果を決めるすべての値のハッシュを返す
+    （jitはuse_jitで解決した値を使い，コンパイル済みカーネルとNumPyの結果を区別する）
+    """
+    if not cacheable_seed(seed):
+        raise TypeError(f"seed must be an int or a SeedSequence: {seed!r}")
+    if isinstance(seed, np.random.SeedSequence):
+        seed = (seed.entropy, seed.spawn_key, seed.pool_size)
+    else:
+        seed = int(seed)
+    h = hashlib.sha256()
+    h.update(np.asarray(gene, dtype=np.float64).tobytes())
+    h.update(np.asarray(setting, dtype=np.float64).tobytes())
+    h.update(
+        repr(
+            (
+                kind,
+                float(mu_0),
+                int(c_mode),
+                seed,
+                decimal_places,
+                int(stride),
+                bool(pirouette),
+                bool(oed.use_jit(jit)),
+                method,
+                tolerance,
+                max_dt,
+                np.dtype(dtype).str,
+            )
+        ).encode()
+    )
+    return h.hexdigest()
+
+
+def line_seed(seed, index):
+    """
+    seed: 図全体のシード（Noneの場合はNoneを返す）
+    index: 軌跡の番号
+
+    図の中の各軌跡に，SeedSequence(seed).spawn で得られるのと同じ子シードを割り当てる
+    """
+    if seed is None:
+        return None
+    return np.random.SeedSequence(seed, spawn_key=(index,))
+
+
+def cache_path(key, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, key + ".npz")
+
+
+def load(key, cache_dir=None):
+    """
+    保存された結果を返す（ない場合はNone）
+    読み込んだファイルは最近使ったものとして更新時刻を新しくする
+    """
+    path = cache_path(key, cache_dir)
+    try:
+        with np.load(path) as data:
+            result = {name: data[name] for name in data.files}
+        os.utime(path)
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return None
+    return result
+
+
+def save(key, cache_dir=None, **arrays):
+    """
+    結果を圧縮して保存し，上限を超えた分を削除する
+    """
+    path = cache_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 並列に書き込まれても壊れたファイルが読まれないよう，一時ファイルから置き換える
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    evict(cache_dir)
+
+
+def evict(cache_dir=None):
+    """
+    合計サイズがmax_bytes以下になるまで，最後に使われた時刻が古いものから削除する
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    files = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".npz") and ".tmp." not in entry.name:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def clear(cache_dir=None):
+    """
+    保存されたすべての結果を削除する
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    if os.path.isdir(cache_dir):
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(".npz"):
+                os.remove(entry.path)
+
+
+def klinotaxis(
+    gene,
+    mu_0,
+    c_mode,
+    decimal_places=None,
+    setting=None,
+    seed=None,
+    stride=1,
+    jit=None,
+    method="euler",
+    dtype=np.float64,
+):
+    """
+    oed.klinotaxisの結果をキャッシュから返す（ない場合は計算して保存する）
+    seedがintまたはSeedSequenceでない場合は結果を再現できないため，キャッシュを使わない
+    """
+    if setting is None:
+        setting = oed.constant("setting")
+    options = dict(jit=jit, method=method, dtype=dtype)
+    if not cacheable_seed(seed):
+        return oed.klinotaxis(
+            gene,
+            mu_0,
+            c_mode,
+            decimal_places,
+            setting=setting,
+            stride=stride,
+            seed=seed,
+            **options,
+        )
+
+    key = cache_key(
+        "klinotaxis",
+        gene,
+        mu_0,
+        c_mode,
+        setting,
+        seed,
+        decimal_places,
+        stride,
+        **options,
+    )
+    result = load(key)
+    if result is not None:
+        return result["r"]
+
+    r = oed.klinotaxis(
+        gene,
+        mu_0,
+        c_mode,
+        decimal_places,
+        setting=setting,
+        stride=stride,
+        seed=seed,
+        **options,
+    )
+    save(key, r=r)
+    return r
+
+
+def klinotaxis_membrane_potential(
+    gene, mu_0, c_mode, setting=None, seed=None, jit=None
+):
+    """
+    oed.klinotaxis_membrane_potentialの結果をキャッシュから返す
+    （ない場合は計算して保存する）
+    軌跡は同じシードのklinotaxisと同じなので"klinotaxis"の結果として共有し，
+    膜電位だけを別に保存する（trajectoryの後にtrajectory_membrane_potentialを
+    描いても軌跡を計算し直さない）
+    seedがintまたはSeedSequenceでない場合は結果を再現できないため，キャッシュを使わない
+    """
+    if setting is None:
+        setting = oed.constant("setting")
+    if not cacheable_seed(seed):
+        return oed.klinotaxis_membrane_potential(
+            gene, mu_0, c_mode, jit=jit, setting=setting, seed=seed
+        )
+
+    r_key = cache_key("klinotaxis", gene, mu_0, c_mode, setting, seed, None, jit=jit)
+    y_key = cache_key(
+        "membrane_potential", gene, mu_0, c_mode, setting, seed, None, jit=jit
+    )
+    r_result = load(r_key)
+    y_result = load(y_key)
+    if r_result is not None and y_result is not None:
+        return r_result["r"], y_result["y"]
+
+    # 膜電位は軌跡と同時にしか計算できないので，どちらかがなければ両方計算する
+    r, y = oed.klinotaxis_membrane_potential(
+        gene, mu_0, c_mode, jit=jit, setting=setting, seed=seed
+    )
+    if r_result is None:
+        save(r_key, r=r)
+    save(y_key, y=y)
+    return r, y
@@ -0,0 +1,196 @@
+import atexit
+import multiprocessing
+import os
+import queue
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+import numpy as np
+
+# 使い回すプロセスプール（最初に使われたときに作成する）
+_pool = None
+_process = None
+# ワーカー数（Noneの場合はCPUのコア数）
+process_number = None
+# このプロセスのresource_trackerが親プロセスと別のものか（プロセスIDごと）
+_own_tracker = {}
+
+
+def set_process_number(process=None):
+    """
+    process: ワーカー数（Noneの場合はCPUのコア数）
+
+    ワーカー数を変更する（作成済みのプールは次に使うときに作り直す）
+    """
+    global process_number
+    process_number = process
+    if _pool is not None and _process != (process or multiprocessing.cpu_count()):
+        shutdown()
+
+
+def get_pool():
+    """
+    共有のプロセスプールを返す（なければ作成する）
+    """
+    global _pool, _process
+    if _pool is None:
+        _process = process_number or multiprocessing.cpu_count()
+        _pool = multiprocessing.Pool(_process)
+    return _pool
+
+
+def shutdown():
+    """
+    実行中のタスクが終わるのを待ってからプールを閉じる
+    """
+    global _pool, _process
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
+        _process = None
+
+
+atexit.register(shutdown)
+
+
+def map(func, iterable):
+    """
+    共有のプールで func を iterable の各要素に適用し，結果を順番通りに返す
+    """
+    return get_pool().map(func, iterable)
+
+
+def imap_indexed(func, iterable, max_pending=None):
+    """
+    func: 各要素に適用する関数
+    iterable: 引数の列
+    max_pending: 同時に投入するタスクの最大数（Noneの場合はワーカー数）
+
+    計算が終わった順に (引数の番号, 結果) を返すジェネレーター
+    投入するタスクの数を制限するので，途中でループを抜けても
+    残りのタスクがプールを占有し続けることはない
+    """
+    pool = get_pool()
+    if max_pending is None:
+        max_pending = _process
+    results = queue.Queue()
+    args = enumerate(iterable)
+    pending = 0
+
+    def submit():
+        nonlocal pending
+        for index, arg in args:
+            pool.apply_async(
+                func,
+                (arg,),
+                callback=lambda result: results.put((index, result)),
+                error_callback=results.put,
+            )
+            pending += 1
+            return
+
+    for _ in range(max_pending):
+        submit()
+    while pending > 0:
+        result = results.get()
+        pending -= 1
+        if isinstance(result, BaseException):
+            raise result
+        submit()
+        yield result
+
+
+def imap_unordered(func, iterable, max_pending=None):
+    """
+    計算が終わった順に結果を返す（imap_indexedを参照）
+    """
+    for index, result in imap_indexed(func, iterable, max_pending):
+        yield result
+
+
+def imap(func, iterable, max_pending=None):
+    """
+    引数の順番通りに結果を返す（imap_indexedを参照）
+    先に終わった結果は，それより前の結果がそろうまで保持する
+    """
+    done = {}
+    next_index = 0
+    for index, result in imap_indexed(func, iterable, max_pending):
+        done[index] = result
+        while next_index in done:
+            yield done.pop(next_index)
+            next_index += 1
+
+
+class SharedArray:
+    """
+    shape: 配列の形
+    dtype: 配列の型
+
+    ワーカーと共有するNumPy配列（multiprocessing.shared_memory上に確保する）
+    ワーカーへはメモリの名前だけが渡されるので，結果を書き込ませれば
+    大きな配列をpickleして親プロセスに送り返す必要がない
+    Pool.mapは引数をチャンクに分けて送るので，同じチャンクのタスクは
+    ワーカー内で1つのSharedArrayを共有する．タスク内ではclose()を呼ばない
+    （ワーカー側の割り当ては参照がなくなったときに閉じる）
+    使用例：
+    with executor.SharedArray((n, 2, steps)) as shared:
+        executor.map(func, [(shared, i) for i in range(n)])  # func内で shared.array[i] = ...
+        result = shared.array.copy()
+    """
+
+    def __init__(self, shape, dtype=np.float64):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(self.shape)) * self.dtype.itemsize)
+        self.shm = shared_memory.SharedMemory(create=True, size=size)
+        self.owner = True
+        self.array = np.ndarray(self.shape, self.dtype, buffer=self.shm.buf)
+
+    def __getstate__(self):
+        return self.shm.name, self.shape, self.dtype
+
+    def __setstate__(self, state):
+        name, self.shape, self.dtype = state
+        try:
+            # 作成したプロセスだけが解放を管理する（Python 3.13以降）
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python 3.12以前は割り当て時に登録されるので，ワーカーが自分の
+            # resource_trackerを持つ場合（共有メモリより先にプールを作った場合）は
+            # 登録を取り消す（取り消さないと，親プロセスの解放した共有メモリを
+            # 終了時に再び解放しようとする）．親プロセスと共有している場合は
+            # 親プロセスの登録を消してしまうので取り消さない
+            pid = os.getpid()
+            if pid not in _own_tracker:
+                _own_tracker[pid] = resource_tracker._resource_tracker._fd is None
+            self.shm = shared_memory.SharedMemory(name=name)
+            if _own_tracker[pid]:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.owner = False
+        self.array = np.ndarray(self.shape, self.dtype, buffer=self.shm.buf)
+
+    def close(self):
+        """
+        このプロセスでの割り当てを閉じる（作成したプロセスではメモリも解放する）
+        """
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __del__(self):
+        # ワーカー側の割り当ては，チャンク内のすべてのタスクが使い終わり
+        # 参照がなくなったときに閉じる（作成したプロセスはclose()で閉じる）
+        if not getattr(self, "owner", True):
+            self.array = None
+            try:
+                self.shm.close()
+            except (BufferError, OSError):
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
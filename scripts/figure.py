@@ -1,5 +1,4 @@
 import numpy as np
-import multiprocessing
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from matplotlib.collections import LineCollection
@@ -7,6 +6,9 @@ from matplotlib.colors import Normalize
 from mpl_toolkits.axes_grid1.inset_locator import inset_axes
 from scripts import oed
 from scripts import load
+from scripts import executor
+from scripts import cache
+from scripts import tasks
 
 
 def trajectory_old(r):
@@ -52,18 +54,48 @@ def trajectory_old(r):
     return
 
 
-def single_line_stacks(x, y):
-    lines = []
-    for coord in range(1, len(x), 2):
-        x_elems = x[coord - 1 : coord + 2]
-        y_elems = y[coord - 1 : coord + 2]
-        lines.append(np.column_stack([x_elems, y_elems]))
-    return lines
+def decimate_points(x, y, resolution):
+    """
+    x, y: 軌跡の座標
+    resolution: 画面上の1ピクセルに相当する長さ
+
+    同じピクセル内に収まる連続した点を間引き，残す点のインデックスを返す
+    （最初と最後の点は必ず残す）
+    """
+    pixel = np.floor(np.column_stack([x, y]) / resolution)
+    keep = np.ones(len(x), dtype=bool)
+    keep[1:-1] = np.any(pixel[1:-1] != pixel[:-2], axis=1)
+    return np.flatnonzero(keep)
+
 
+def single_line_stacks(x, y, resolution=None, return_index=False):
+    """
+    x, y: 軌跡の座標
+    resolution: 画面上の1ピクセルに相当する長さ（指定した場合は点を間引く）
+    return_index: 各線分の始点のインデックスも返すかどうか
 
-def calculate_trajectory(gene_angle_list):
-    gene, angle, c_mode, decimal_places = gene_angle_list
-    return oed.klinotaxis(gene, angle, c_mode, decimal_places)
+    2点ずつずらした3点の線分 (K, 3, 2) をLineCollection用に返す
+    座標を一度だけ (2K+1, 2) の配列にまとめ，線分はそのビュー（コピーなし）
+    点の数が偶数の場合は最後の点を重ねて3点にそろえる
+    """
+    index = np.arange(len(x))
+    if resolution is not None:
+        index = decimate_points(x, y, resolution)
+        x, y = x[index], y[index]
+    lines_number = len(x) // 2
+    points = np.empty((2 * lines_number + 1, 2))
+    points[: len(x), 0] = x
+    points[: len(x), 1] = y
+    points[len(x) :] = points[len(x) - 1]
+    lines = np.lib.stride_tricks.as_strided(
+        points,
+        shape=(lines_number, 3, 2),
+        strides=(2 * points.strides[0], points.strides[0], points.strides[1]),
+        writeable=False,
+    )
+    if return_index:
+        return lines, index[: 2 * lines_number : 2]
+    return lines
 
 
 def trajectory(
@@ -74,32 +106,43 @@ def trajectory(
     out_file_path,
     zoom=True,
     decimal_places=None,
+    resolution=None,
+    seed=None,
 ):
-    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = oed.constant(
-        "setting"
-    )
+    """
+    resolution: 画面上の1ピクセルに相当する長さ（指定した場合は描画する点を間引く）
+    seed: 乱数のシード（指定した場合は計算した軌跡をキャッシュし，再描画時に使い回す）
+    """
+    setting = oed.constant("setting")
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
     fig, ax = plt.subplots(figsize=(10, 7))
 
-    # マルチスレッドの使用プロセス数
-    if lines_number < multiprocessing.cpu_count():
-        process = lines_number
-    else:
-        process = multiprocessing.cpu_count()
-
-    # マルチスレッドで処理する遺伝子と角度のリスト
-    gene_angle_list = [
-        [gene, angle, c_mode, decimal_places]
-        for angle in np.arange(0, 2 * np.pi, 2 * np.pi / lines_number)
-    ]
-
-    # マルチスレッド処理
-    with multiprocessing.Pool(process) as pool:
-        results = pool.map(calculate_trajectory, gene_angle_list)
+    angles = np.arange(0, 2 * np.pi, 2 * np.pi / lines_number)
+    steps = len(np.arange(0, time, dt))
+    with executor.SharedArray((len(angles), 2, steps)) as shared:
+        # マルチスレッドで処理する遺伝子と角度のリスト
+        gene_angle_list = [
+            [
+                gene,
+                angle,
+                c_mode,
+                decimal_places,
+                setting,
+                cache.line_seed(seed, i),
+                shared,
+                i,
+            ]
+            for i, angle in enumerate(angles)
+        ]
+
+        # 共有のプロセスプールで並列処理
+        executor.map(tasks.calculate_trajectory, gene_angle_list)
+        results = shared.array.copy()
 
     # トラジェクトリーの表示
     for idx, r in enumerate(results):
-        lines = single_line_stacks(r[0], r[1])
-        color = np.linspace(0, time, len(lines))
+        lines, index = single_line_stacks(r[0], r[1], resolution, return_index=True)
+        color = index * dt
         lc = LineCollection(lines, cmap="jet", linewidth=1, array=color)
         line = ax.add_collection(lc)
 
@@ -210,7 +253,8 @@ def newron_output(
     trajectory_salt="HighLow",
     trajectory_show=True,
 ):
-    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = oed.weight(gene)
+    # ギャップ結合とリーク項をまとめた結合行列aは遺伝子ごとにキャッシュされている
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = oed.decode(gene).coupled_weights
     alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = oed.constant(
         "setting_newron_output"
     )
@@ -293,15 +337,14 @@ def newron_output(
             for k in range(len(t) - 1):
                 # シナプス結合およびギャップ結合からの入力
                 synapse = np.dot(w.T, oed.sigmoid(y[:, k] + theta))
-                gap = np.array([np.dot(g[:, i], (y[:, k] - y[i, k])) for i in range(8)])
+                leak_gap = np.dot(a.T, y[:, k])
 
                 # 介在ニューロンおよび運動ニューロンの膜電位の更新
                 y[:, k + 1] = (
                     y[:, k]
                     + (
-                        -y[:, k]
+                        leak_gap
                         + synapse
-                        + gap
                         + w_on * ASEL[k]
                         + w_off * ASER[k]
                         + w_osc * oed.y_osc(t[k], T)
@@ -346,15 +389,14 @@ def newron_output(
         for k in range(len(t) - 1):
             # シナプス結合およびギャップ結合からの入力
             synapse = np.dot(w.T, oed.sigmoid(y[:, k] + theta))
-            gap = np.array([np.dot(g[:, i], (y[:, k] - y[i, k])) for i in range(8)])
+            leak_gap = np.dot(a.T, y[:, k])
 
             # 介在ニューロンおよび運動ニューロンの膜電位の更新
             y[:, k + 1] = (
                 y[:, k]
                 + (
-                    -y[:, k]
+                    leak_gap
                     + synapse
-                    + gap
                     + w_on * ASEL[k]
                     + w_off * ASER[k]
                     + w_osc * oed.y_osc(t[k], T)
@@ -578,7 +620,8 @@ def newron_membrane_potential(
         ylim_setting: dict, 各プロットのylimとyticksの設定（任意）
     """
 
-    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = oed.weight(gene)
+    # ギャップ結合とリーク項をまとめた結合行列aは遺伝子ごとにキャッシュされている
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = oed.decode(gene).coupled_weights
     alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = oed.constant(
         "setting_newron_output"
     )
@@ -615,13 +658,12 @@ def newron_membrane_potential(
 
             for k in range(len(t) - 1):
                 synapse = np.dot(w.T, oed.sigmoid(y[:, k] + theta))
-                gap = np.array([np.dot(g[:, i], (y[:, k] - y[i, k])) for i in range(8)])
+                leak_gap = np.dot(a.T, y[:, k])
                 y[:, k + 1] = (
                     y[:, k]
                     + (
-                        -y[:, k]
+                        leak_gap
                         + synapse
-                        + gap
                         + w_on * ASEL[k]
                         + w_off * ASER[k]
                         + w_osc * oed.y_osc(t[k], T)
@@ -639,13 +681,12 @@ def newron_membrane_potential(
         ASER = np.zeros(len(t))
         for k in range(len(t) - 1):
             synapse = np.dot(w.T, oed.sigmoid(y[:, k] + theta))
-            gap = np.array([np.dot(g[:, i], (y[:, k] - y[i, k])) for i in range(8)])
+            leak_gap = np.dot(a.T, y[:, k])
             y[:, k + 1] = (
                 y[:, k]
                 + (
-                    -y[:, k]
+                    leak_gap
                     + synapse
-                    + gap
                     + w_on * ASEL[k]
                     + w_off * ASER[k]
                     + w_osc * oed.y_osc(t[k], T)
@@ -679,6 +720,11 @@ def newron_membrane_potential(
 
 
 def Bearing_vs_Curving_rate(in_file_path, out_file_path):
+    """
+    in_file_path: 解析結果のtxtファイルのパス
+                  （または klinotaxis_analysis.bearing_vs_curving_rate の戻り値）
+    out_file_path: 図の保存先
+    """
     data = load.load_output_txt(in_file_path)
 
     plt.errorbar(
@@ -710,6 +756,12 @@ def Normal_gradient_vs_Curving_rate(
     out_file_path,
     layout=False,
 ):
+    """
+    in_file_path: 解析結果のtxtファイルのパス
+                  （または klinotaxis_analysis.normal_gradient_vs_curving_rate の戻り値）
+    out_file_path: 図の保存先
+    layout: 軸の範囲と目盛りを固定するかどうか
+    """
     data = load.load_output_txt(in_file_path)
 
     plt.errorbar(
@@ -739,6 +791,11 @@ def Normal_gradient_vs_Curving_rate(
 
 
 def Translational_gradient_vs_Curving_rate(in_file_path, out_file_path):
+    """
+    in_file_path: 解析結果のtxtファイルのパス（または
+                  klinotaxis_analysis.translational_gradient_vs_curving_rate の戻り値）
+    out_file_path: 図の保存先
+    """
     data = load.load_output_txt(in_file_path)
 
     plt.scatter(data[0], data[1], s=6, c="black", marker="o", edgecolors="black")
@@ -1149,51 +1206,40 @@ def connectome(gene, out_file_path):
     return
 
 
-def calculate_trajectory_membrane_potential(gene_angle_list):
-    gene, angle, c_mode = gene_angle_list
-
-    r, y = oed.klinotaxis_membrane_potential(gene, angle, c_mode)
-
-    lines = single_line_stacks(r[0], r[1])
-    aiy = (y[0] + y[1]) / 2
-    aiz = (y[2] + y[3]) / 2
-
-    return lines, aiy, aiz
-
-
-def trajectory_membrane_potential(gene, c_mode, lines_number, out_file_path):
-    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = oed.constant(
-        "setting"
-    )
+def trajectory_membrane_potential(gene, c_mode, lines_number, out_file_path, seed=None):
+    """
+    seed: 乱数のシード（指定した場合は計算した軌跡をキャッシュし，再描画時に使い回す）
+    """
+    setting = oed.constant("setting")
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
     fig, ax = plt.subplots(2, 1, figsize=(10, 7))
 
     top = 0
     bottom = 1
     cmap = "seismic"
 
-    # マルチスレッドの使用プロセス数
-    if lines_number < multiprocessing.cpu_count():
-        process = lines_number
-    else:
-        process = multiprocessing.cpu_count()
-
-    # マルチスレッドで処理する遺伝子と角度のリスト
-    gene_angle_c_mode_list = [
-        [gene, angle, c_mode]
-        for angle in np.arange(0, 2 * np.pi, 2 * np.pi / lines_number)
-    ]
-
-    # マルチスレッド処理
-    with multiprocessing.Pool(process) as pool:
-        results = pool.map(
-            calculate_trajectory_membrane_potential, gene_angle_c_mode_list
+    angles = np.arange(0, 2 * np.pi, 2 * np.pi / lines_number)
+    steps = len(np.arange(0, time, dt))
+    with executor.SharedArray((len(angles), 4, steps)) as shared:
+        # マルチスレッドで処理する遺伝子と角度のリスト
+        gene_angle_c_mode_list = [
+            [gene, angle, c_mode, setting, cache.line_seed(seed, i), shared, i]
+            for i, angle in enumerate(angles)
+        ]
+
+        # 共有のプロセスプールで並列処理
+        executor.map(
+            tasks.calculate_trajectory_membrane_potential, gene_angle_c_mode_list
         )
+        results = shared.array.copy()
 
     # 結果を分解して格納
-    all_lines, all_aiy, all_aiz = zip(*results)
+    all_lines = [single_line_stacks(r[0], r[1]) for r in results]
+    all_aiy = results[:, 2]
+    all_aiz = results[:, 3]
 
-    flat_aiy = np.array(all_aiy).flatten()
-    flat_aiz = np.array(all_aiz).flatten()
+    flat_aiy = all_aiy.flatten()
+    flat_aiz = all_aiz.flatten()
 
     mean_aiy = np.mean(flat_aiy)
     std_dev_aiy = np.std(flat_aiy)
@@ -0,0 +1,473 @@
+import os
+import numpy as np
+from scripts import oed
+from scripts import executor
+
+
+def lag_steps(setting, periodic_number):
+    """
+    setting: 設定
+    periodic_number: 周期の数
+
+    periodic_number周期分のステップ数を返す
+    """
+    return periodic_number * int(np.floor(setting.T / setting.dt))
+
+
+def signed_angle(a, b):
+    """
+    a, b: ベクトルの配列 (..., 2, L)（aは(2, 1)などブロードキャストできる形でもよい）
+
+    aからbへの角度（度）を反時計回りを正として返す
+    """
+    cross = a[..., 0, :] * b[..., 1, :] - a[..., 1, :] * b[..., 0, :]
+    dot = a[..., 0, :] * b[..., 0, :] + a[..., 1, :] * b[..., 1, :]
+    return np.degrees(np.arctan2(cross, dot))
+
+
+def bearing(r, setting, periodic_number):
+    """
+    r: 軌跡 (..., 2, S)
+    setting: 設定
+    periodic_number: 進行方向を求める周期の数
+
+    濃度のピークの方向から見た進行方向の角度（度）を (..., S - 2P) で返す
+    （P: periodic_number周期分のステップ数，ピークより左へ進む場合を正）
+    """
+    P = lag_steps(setting, periodic_number)
+    L = r.shape[-1] - 2 * P
+    direction = r[..., P : P + L] - r[..., :L]
+    peak = np.array([[setting.x_peak], [setting.y_peak]])
+    return -signed_angle(peak, direction)
+
+
+def curving_rate(r, setting, periodic_number):
+    """
+    r: 軌跡 (..., 2, S)
+    setting: 設定
+    periodic_number: 進行方向を求める周期の数
+
+    連続する2つの進行方向のなす角（度）を移動距離で割った曲率を (..., S - 2P) で返す
+    （左に曲がる場合を正）
+    """
+    P = lag_steps(setting, periodic_number)
+    L = r.shape[-1] - 2 * P
+    direction_1 = r[..., P : P + L] - r[..., :L]
+    direction_2 = r[..., 2 * P :] - r[..., P : P + L]
+    distance = np.hypot(direction_1[..., 0, :], direction_1[..., 1, :]) + np.hypot(
+        direction_2[..., 0, :], direction_2[..., 1, :]
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return signed_angle(direction_1, direction_2) / distance
+
+
+def direction_gradient(r, c_mode, setting, periodic_number, normal):
+    """
+    r: 軌跡 (..., 2, S)
+    c_mode: 濃度関数の種類
+    setting: 設定
+    periodic_number: 進行方向を求める周期の数
+    normal: Trueの場合は進行方向の左向きの法線，Falseの場合は進行方向の勾配
+
+    各時刻の位置での濃度勾配を，単位方向ベクトルへ射影した値を (..., S - 2P) で返す
+    勾配は解析的に求めるので，差分のための濃度の計算は必要ない
+    """
+    P = lag_steps(setting, periodic_number)
+    L = r.shape[-1] - 2 * P
+    dx, dy = np.moveaxis(r[..., P : P + L] - r[..., :L], -2, 0)
+    if normal:
+        dx, dy = -dy, dx
+    gx, gy = oed.concentration_gradient(c_mode, setting, r[..., 0, :L], r[..., 1, :L])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (gx * dx + gy * dy) / np.hypot(dx, dy)
+
+
+def normal_gradient(r, c_mode, setting, periodic_number):
+    """
+    進行方向の左向きの法線方向の濃度勾配を返す（direction_gradientを参照）
+    """
+    return direction_gradient(r, c_mode, setting, periodic_number, True)
+
+
+def translational_gradient(r, c_mode, setting, periodic_number):
+    """
+    進行方向の濃度勾配を返す（direction_gradientを参照）
+    """
+    return direction_gradient(r, c_mode, setting, periodic_number, False)
+
+
+class BinnedStatistics:
+    """
+    edges: ビンの境界 (ビンの数 + 1,)
+
+    ワームごとにビン内のyの平均をとり，そのワーム間の平均・標準偏差・最大値・最小値を
+    逐次集計する（境界上の値，範囲外の値およびNaNは数えない）
+    ワームの数によらずメモリはビンの数に比例し，別々に集計した結果はmergeでまとめられる
+    """
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=float)
+        n_bins = len(self.edges) - 1
+        self.count = np.zeros(n_bins, dtype=int)
+        self.mean = np.zeros(n_bins)
+        self.m2 = np.zeros(n_bins)
+        self.max = np.full(n_bins, -np.inf)
+        self.min = np.full(n_bins, np.inf)
+
+    def worm_means(self, x, y):
+        """
+        x: ビン分けする値 (n, L)
+        y: 平均をとる値 (n, L)
+
+        ワームごとのビン内のyの平均を (n, ビンの数) で返す（値がないビンはNaN）
+        """
+        x = np.atleast_2d(x)
+        y = np.atleast_2d(y)
+        n, n_bins = len(x), len(self.edges) - 1
+        # edges[b] <= x < edges[b + 1] となるb（NaNは範囲外になる）
+        b = np.searchsorted(self.edges, x, side="right") - 1
+        valid = (b >= 0) & (b < n_bins) & np.isfinite(y)
+        valid &= x > self.edges[np.clip(b, 0, n_bins)]
+        flat = (np.arange(n)[:, None] * n_bins + b)[valid]
+        sums = np.bincount(flat, weights=y[valid], minlength=n * n_bins)
+        counts = np.bincount(flat, minlength=n * n_bins)
+        with np.errstate(invalid="ignore"):
+            return (sums / counts).reshape(n, n_bins)
+
+    def add(self, x, y):
+        """
+        x: ビン分けする値 (n, L)
+        y: 平均をとる値 (n, L)
+
+        n匹分のワームごとの平均を集計に加える
+        """
+        self.add_means(self.worm_means(x, y))
+
+    def add_means(self, means):
+        """
+        means: ワームごとのビン内の平均 (n, ビンの数)
+
+        NaNを除いて集計に加える（ビンごとの平均と偏差平方和をまとめて更新する）
+        """
+        has = ~np.isnan(means)
+        count = has.sum(axis=0)
+        with np.errstate(invalid="ignore"):
+            mean = np.where(count > 0, np.nansum(means, axis=0) / count, 0)
+        m2 = np.where(has, (means - mean) ** 2, 0).sum(axis=0)
+        self.max = np.fmax(self.max, np.where(has, means, -np.inf).max(axis=0))
+        self.min = np.fmin(self.min, np.where(has, means, np.inf).min(axis=0))
+        self.combine(count, mean, m2)
+
+    def combine(self, count, mean, m2):
+        total = self.count + count
+        with np.errstate(invalid="ignore"):
+            delta = mean - self.mean
+            self.mean = np.where(total > 0, self.mean + delta * count / total, 0)
+            self.m2 = np.where(
+                total > 0, self.m2 + m2 + delta**2 * self.count * count / total, 0
+            )
+        self.count = total
+
+    def merge(self, other):
+        """
+        other: 同じビンで集計したBinnedStatistics
+
+        別に集計した結果をまとめる
+        """
+        self.max = np.fmax(self.max, other.max)
+        self.min = np.fmin(self.min, other.min)
+        self.combine(other.count, other.mean, other.m2)
+        return self
+
+    def result(self):
+        """
+        「ビンの始点, 平均, 標準偏差, 最大値, 最小値」の列を (ビンの数, 5) で返す
+        （値のないビンはNaN）
+        """
+        empty = self.count == 0
+        with np.errstate(invalid="ignore"):
+            std = np.sqrt(self.m2 / self.count)
+        columns = [self.mean, std, self.max, self.min]
+        return np.column_stack(
+            [self.edges[:-1]] + [np.where(empty, np.nan, c) for c in columns]
+        )
+
+
+def bearing_edges(bin_range):
+    """
+    bin_range: ビンの幅（度）
+
+    -180度から180度までのビンの境界を返す
+    """
+    return np.append(np.arange(-180, 180, bin_range), 180).astype(float)
+
+
+def gradient_edges(bin_number, concentration_gradient_max):
+    """
+    bin_number: ビンの数
+    concentration_gradient_max: 濃度勾配の範囲の最大値
+
+    -concentration_gradient_max から concentration_gradient_max までを
+    bin_number等分したビンの境界を返す
+    """
+    step = 2 * concentration_gradient_max / bin_number
+    return -concentration_gradient_max + np.arange(bin_number + 1) * step
+
+
+def analysis_values(kind, r, c_mode, setting, periodic_number):
+    """
+    kind: 横軸の種類 ("bearing", "normal_gradient", "translational_gradient")
+    r: 軌跡 (n, 2, S)
+
+    ビン分けに使う横軸の値を返す
+    """
+    if kind == "bearing":
+        return bearing(r, setting, periodic_number)
+    elif kind == "normal_gradient":
+        return normal_gradient(r, c_mode, setting, periodic_number)
+    elif kind == "translational_gradient":
+        return translational_gradient(r, c_mode, setting, periodic_number)
+    raise ValueError(f"unknown analysis: {kind}")
+
+
+def analysis_batch(args):
+    """
+    args: (横軸の種類, 遺伝子, 初期角度 (n,), 濃度関数の種類, 設定, 乱数のシード,
+           周期の数, 捨てる周期の数, ビンの境界, 曲率の正負で分けて集計するかどうか)
+
+    n匹のワームを計算し，横軸の値に対する曲率を集計したBinnedStatisticsのリストを返す
+    （正負で分ける場合は [すべて, 正の曲率のみ, 負の曲率のみ]，プールのワーカーで実行する）
+    """
+    (
+        kind,
+        gene,
+        mu_0,
+        c_mode,
+        setting,
+        seed,
+        periodic_number,
+        periodic_number_drain,
+        edges,
+        sign_split,
+    ) = args
+    (r,) = oed.simulate(
+        gene, mu_0, c_mode, [oed.PositionRecorder()], setting=setting, seed=seed
+    )
+    drain = lag_steps(setting, periodic_number_drain)
+    x = analysis_values(kind, r, c_mode, setting, periodic_number)[:, drain:]
+    y = curving_rate(r, setting, periodic_number)[:, drain:]
+    del r
+
+    ys = [y]
+    if sign_split:
+        ys += [np.where(y > 0, y, np.nan), np.where(y < 0, y, np.nan)]
+    stats_list = []
+    for values in ys:
+        stats = BinnedStatistics(edges)
+        stats.add(x, values)
+        stats_list.append(stats)
+    return stats_list
+
+
+def binned_curving_rate(
+    kind,
+    gene,
+    edges,
+    c_mode,
+    worms,
+    periodic_number,
+    periodic_number_drain,
+    setting,
+    batch_size,
+    seed,
+    sign_split=False,
+):
+    """
+    横軸の値に対する曲率をバッチごとに共有のプロセスプールで集計し，
+    まとめたBinnedStatisticsのリストを返す（analysis_batchを参照）
+    軌跡はバッチごとに集計して捨てるので，ワームの数が多くてもメモリは増えない
+    """
+    if setting is None:
+        setting = oed.constant("setting_analysis")
+    starts = range(0, worms, batch_size)
+    angle_seed, *batch_seeds = np.random.SeedSequence(seed).spawn(1 + len(starts))
+    mu_0 = np.random.default_rng(angle_seed).uniform(0, 2 * np.pi, worms)
+    args_list = (
+        (
+            kind,
+            gene,
+            mu_0[i : i + batch_size],
+            c_mode,
+            setting,
+            batch_seed,
+            periodic_number,
+            periodic_number_drain,
+            edges,
+            sign_split,
+        )
+        for i, batch_seed in zip(starts, batch_seeds)
+    )
+
+    total = None
+    for stats_list in executor.imap(analysis_batch, args_list):
+        if total is None:
+            total = stats_list
+        else:
+            for stats, batch_stats in zip(total, stats_list):
+                stats.merge(batch_stats)
+    return total
+
+
+def write_output(out_path, data):
+    """
+    out_path: 書き出すファイルのパス
+    data: 書き出す表 (行数, 列数)
+
+    klinotaxis_analysisと同じ「値, 値, ...」の形式で書き出す
+    """
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "w") as txt_file:
+        for row in data:
+            txt_file.write(", ".join(str(value) for value in row) + "\n")
+
+
+def bearing_vs_curving_rate(
+    gene,
+    c_mode=1,
+    worms=100000,
+    periodic_number=3,
+    periodic_number_drain=3,
+    bin_range=10,
+    setting=None,
+    batch_size=100,
+    seed=None,
+    out_path=None,
+):
+    """
+    gene: 遺伝子
+    c_mode: 濃度関数の種類
+    worms: 平均をとるワームの数
+    periodic_number: 進行方向を求める周期の数
+    periodic_number_drain: 最初に捨てる周期の数
+    bin_range: 進行方向の角度のビンの幅（度）
+    setting: 設定（Noneの場合は"setting_analysis"セクションを読み込む）
+    batch_size: 1つのタスクでまとめて計算するワームの数
+    seed: 乱数のシード（バッチごとに子シードを分岐させる）
+    out_path: 結果を書き出すファイルのパス（Noneの場合は書き出さない）
+
+    進行方向の角度（bearing）に対する曲率（curving rate）をワームごとにビンで平均し，
+    「ビンの始点, 平均, 標準偏差, 最大値, 最小値」の表を (ビンの数, 5) で返す
+    使用例：
+    data = klinotaxis_analysis.bearing_vs_curving_rate(gene, worms=1000, seed=0)
+    figure.Bearing_vs_Curving_rate(data, "../output/bearing.pdf")
+    """
+    (stats,) = binned_curving_rate(
+        "bearing",
+        gene,
+        bearing_edges(bin_range),
+        c_mode,
+        worms,
+        periodic_number,
+        periodic_number_drain,
+        setting,
+        batch_size,
+        seed,
+    )
+    data = stats.result()
+
+    if out_path is not None:
+        write_output(out_path, data)
+
+    return data
+
+
+def normal_gradient_vs_curving_rate(
+    gene,
+    c_mode=1,
+    worms=100000,
+    periodic_number=3,
+    periodic_number_drain=3,
+    bin_number=30,
+    concentration_gradient_max=0.05,
+    setting=None,
+    batch_size=100,
+    seed=None,
+    out_path=None,
+):
+    """
+    gene: 遺伝子
+    c_mode: 濃度関数の種類
+    worms: 平均をとるワームの数
+    periodic_number: 進行方向を求める周期の数
+    periodic_number_drain: 最初に捨てる周期の数
+    bin_number: 濃度勾配のビンの数
+    concentration_gradient_max: 濃度勾配の範囲の最大値
+    setting: 設定（Noneの場合は"setting_analysis"セクションを読み込む）
+    batch_size: 1つのタスクでまとめて計算するワームの数
+    seed: 乱数のシード（バッチごとに子シードを分岐させる）
+    out_path: 結果を書き出すファイルのパス（Noneの場合は書き出さない）
+
+    進行方向の法線方向の濃度勾配（normal gradient）に対する曲率をワームごとにビンで平均し，
+    「ビンの始点, 平均, 標準偏差, 最大値, 最小値」の表を (ビンの数, 5) で返す
+    """
+    (stats,) = binned_curving_rate(
+        "normal_gradient",
+        gene,
+        gradient_edges(bin_number, concentration_gradient_max),
+        c_mode,
+        worms,
+        periodic_number,
+        periodic_number_drain,
+        setting,
+        batch_size,
+        seed,
+    )
+    data = stats.result()
+
+    if out_path is not None:
+        write_output(out_path, data)
+
+    return data
+
+
+def translational_gradient_vs_curving_rate(
+    gene,
+    c_mode=1,
+    worms=100000,
+    periodic_number=3,
+    periodic_number_drain=3,
+    bin_number=30,
+    concentration_gradient_max=0.05,
+    setting=None,
+    batch_size=100,
+    seed=None,
+    out_path=None,
+):
+    """
+    引数はnormal_gradient_vs_curving_rateと同じ
+
+    進行方向の濃度勾配（translational gradient）に対する曲率をワームごとにビンで平均し，
+    「ビンの始点, 平均, 標準偏差, 正の曲率の平均, 標準偏差, 負の曲率の平均, 標準偏差」
+    の表を (ビンの数, 7) で返す
+    """
+    stats, positive, negative = binned_curving_rate(
+        "translational_gradient",
+        gene,
+        gradient_edges(bin_number, concentration_gradient_max),
+        c_mode,
+        worms,
+        periodic_number,
+        periodic_number_drain,
+        setting,
+        batch_size,
+        seed,
+        sign_split=True,
+    )
+    data = np.column_stack(
+        [stats.result()[:, :3], positive.result()[:, 1:3], negative.result()[:, 1:3]]
+    )
+
+    if out_path is not None:
+        write_output(out_path, data)
+
+    return data
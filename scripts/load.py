@@ -1,6 +1,10 @@
 import toml
 import json
-import re
+import os
+import numpy as np
+
+# これより大きいtxtファイルは解析結果を.npyとして保存し，次回からメモリマップで読み込む
+MMAP_THRESHOLD = 64 * 2**20
 
 
 def load_simulation_setting_toml(file_path):
@@ -21,41 +25,180 @@ def load_result_json(file_path):
     return data
 
 
-def load_output_txt(file_path):
+def parse_output_txt(file_path):
     """
     file_path: 読み込むアウトプットに関するtxtファイルのパス
 
-    データは列で読み込む（カンマおよびスペースで分割）
+    データを (行数, 最大の列数) の配列として返す
+    カンマおよびスペースで分割し，列の足りない行はNaNで埋める（「#」で始まる行は除外）
     """
+    counts = []
+    tokens = []
     with open(file_path, "r") as txt_file:
-        # ファイルの各行を読み込んでリストに格納
-        lines = txt_file.read().split("\n")
+        for line in txt_file:
+            if line.startswith("#"):
+                continue
+            values = line.replace(",", " ").split()
+            if values:
+                counts.append(len(values))
+                tokens.extend(values)
+
+    counts = np.array(counts, dtype=int)
+    data = np.full((len(counts), counts.max(initial=0)), np.nan)
+    data[np.arange(data.shape[1]) < counts[:, None]] = np.array(tokens, dtype=float)
+    return data
+
+
+def load_output_array(file_path, mmap=None):
+    """
+    file_path: 読み込むアウトプットに関するtxtファイルのパス
+    mmap: 解析結果を.npyとして保存し，メモリマップで読み込むかどうか
+          （Noneの場合はファイルがMMAP_THRESHOLDより大きいときのみ）
+
+    データを (行数, 最大の列数) の配列として返す
+    """
+    if mmap is None:
+        mmap = os.path.getsize(file_path) > MMAP_THRESHOLD
+    if not mmap:
+        return parse_output_txt(file_path)
+
+    # 解析結果はtxtファイルより新しい場合のみ使い回す
+    npy_path = file_path + ".npy"
+    if not os.path.exists(npy_path) or os.path.getmtime(npy_path) < os.path.getmtime(
+        file_path
+    ):
+        np.save(npy_path, parse_output_txt(file_path))
+    return np.load(npy_path, mmap_mode="r")
+
+
+def load_output_txt(file_path, names=None, mmap=None):
+    """
+    file_path: 読み込むアウトプットに関するtxtファイルのパス
+               （または klinotaxis_analysis が返す (行数, 列数) の表）
+    names: 列の名前のリスト（指定した場合は {名前: 列} の辞書で返す）
+    mmap: メモリマップで読み込むかどうか（load_output_arrayを参照）
+
+    データは列で読み込む（カンマおよびスペースで分割）
+    data[i] が i 列目となる (列数, 行数) の配列のビューを返す
+    """
+    if isinstance(file_path, (str, os.PathLike)):
+        columns = load_output_array(file_path, mmap).T
+    else:
+        # 計算済みの表はファイルを介さずにそのまま使う
+        columns = np.asarray(file_path, dtype=float).T
+    if names is None:
+        return columns
+    return dict(zip(names, columns))
+
+
+# バイナリ形式の結果のディレクトリに置くヘッダーのファイル名
+STORE_HEADER = "header.json"
+
+
+def create_store(dir_path, arrays, meta=None):
+    """
+    dir_path: 保存先のディレクトリ
+    arrays: {名前: (形, 型)} の辞書
+    meta: ヘッダーに保存する情報（JSONに書き出せるもの）
 
-    # 「#」で始まる行を除外
-    lines = [line for line in lines if not line.startswith("#")]
+    配列ごとの.npyファイルとJSONのヘッダーからなるディレクトリを作成し，
+    書き込み用のメモリマップ {名前: np.memmap} を返す
+    （大きな結果をすべてメモリに載せずに少しずつ書き込める）
+    """
+    os.makedirs(dir_path, exist_ok=True)
+    header = {"arrays": {}, "meta": meta or {}}
+    memmaps = {}
+    for name, (shape, dtype) in arrays.items():
+        file_name = name + ".npy"
+        memmaps[name] = np.lib.format.open_memmap(
+            os.path.join(dir_path, file_name),
+            mode="w+",
+            dtype=dtype,
+            shape=tuple(shape),
+        )
+        header["arrays"][name] = {
+            "file": file_name,
+            "shape": list(shape),
+            "dtype": np.dtype(dtype).str,
+        }
+    with open(os.path.join(dir_path, STORE_HEADER), "w") as json_file:
+        json_file.write(json.dumps(header, indent=1))
+    return memmaps
 
-    # 分割パターンの正規表現
-    split_pattern = re.compile(r"[,\s]+")
 
-    # 各行での最大列数を求める
-    max_columns = max(
-        len([value for value in split_pattern.split(line) if value.strip()])
-        for line in lines
-        if line
+def save_store(dir_path, arrays, meta=None):
+    """
+    dir_path: 保存先のディレクトリ
+    arrays: {名前: 配列} の辞書
+    meta: ヘッダーに保存する情報（JSONに書き出せるもの）
+    """
+    memmaps = create_store(
+        dir_path,
+        {
+            name: (np.shape(array), np.asarray(array).dtype)
+            for name, array in arrays.items()
+        },
+        meta,
     )
+    for name, array in arrays.items():
+        memmaps[name][...] = array
+        memmaps[name].flush()
+
+
+def load_store_header(dir_path):
+    """
+    dir_path: 読み込むディレクトリ
 
-    # 列ごとのデータを格納するためのリストを初期化
-    columns = [[] for _ in range(max_columns)]
-
-    # 行ごとにデータを列に振り分ける
-    for line in lines:
-        if line:
-            # 各行のデータを正規表現で分割し、空でない文字列を除外してからfloatに変換
-            values = [
-                float(value) for value in split_pattern.split(line) if value.strip()
-            ]
-            # 各列にデータを振り分け
-            for i in range(len(values)):
-                columns[i].append(values[i])
-
-    return columns
+    ヘッダー（{"arrays": 各配列の形と型, "meta": 保存時の情報}）を返す
+    """
+    return load_result_json(os.path.join(dir_path, STORE_HEADER))
+
+
+def load_store(dir_path, names=None):
+    """
+    dir_path: 読み込むディレクトリ
+    names: 読み込む配列の名前のリスト（Noneの場合はすべて）
+
+    {名前: 読み込み専用のnp.memmap} を返す
+    ファイル全体は読み込まないので，一部のワームだけを取り出すことができる
+    使用例：
+    store = load.load_store("../result/trajectory")
+    r = np.asarray(store["r"][:5])  # 最初の5匹の軌跡だけを読み込む
+    """
+    header = load_store_header(dir_path)
+    if names is None:
+        names = list(header["arrays"])
+    return {
+        name: np.lib.format.open_memmap(
+            os.path.join(dir_path, header["arrays"][name]["file"]), mode="r"
+        )
+        for name in names
+    }
+
+
+def convert_result_json(file_path, dir_path):
+    """
+    file_path: 遺伝子に関するjsonファイルのパス
+    dir_path: 保存先のディレクトリ
+
+    遺伝子 (n, 22) と value (n,) をバイナリ形式で保存する
+    """
+    result = load_result_json(file_path)
+    save_store(
+        dir_path,
+        {
+            "gene": np.array([gene_result["gene"] for gene_result in result]),
+            "value": np.array([gene_result["value"] for gene_result in result]),
+        },
+        {"source": file_path},
+    )
+
+
+def convert_output_txt(file_path, dir_path):
+    """
+    file_path: アウトプットに関するtxtファイルのパス
+    dir_path: 保存先のディレクトリ
+
+    (行数, 列数) の配列をdataとしてバイナリ形式で保存する
+    """
+    save_store(dir_path, {"data": parse_output_txt(file_path)}, {"source": file_path})
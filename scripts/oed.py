@@ -1,7 +1,15 @@
 import numpy as np
-import random
+import math
+import os
+import functools
+import importlib.util
 from scripts import load
-import multiprocessing
+from scripts import executor
+from typing import NamedTuple
+
+# numbaは読み込みに時間がかかるため，最初にコンパイル済みカーネルを使うときに読み込む
+numba_available = importlib.util.find_spec("numba") is not None
+kernels_compiled = False
 
 
 def c_(alpha, x_, y_, x_peak, y_peak):
@@ -31,6 +39,249 @@ def y_off(c_t, N_, M_, N, M, dt):
     return y_ * 100 * dt
 
 
+class SensoryHistory:
+    """
+    感覚ニューロンに入力する濃度の履歴
+
+    直近N_+M_ステップの濃度を事前に確保したリングバッファに保持し，
+    ON窓（新しいN_ステップ）とOFF窓（その前のM_ステップ）の和を
+    1ステップごとにO(1)で更新する
+    N_, M_, N, Mに配列を渡すと複数のワームの履歴をまとめて扱う
+    """
+
+    def __init__(self, c_init, N_, M_, N, M, dt, dtype=np.float64):
+        """
+        c_init: 履歴を埋める初期濃度
+        N_, M_: ON窓とOFF窓のステップ数
+        N, M: ON窓とOFF窓の時間
+        dt: 時間刻み
+        dtype: 履歴のバッファの型（窓の和はfloat64で保持する）
+        """
+        self.shape = np.broadcast(c_init, N_, M_, N, M).shape
+        n = int(np.prod(self.shape))
+        self.N_, self.M_, self.N, self.M = [
+            np.array(np.broadcast_to(var, self.shape).reshape(n))
+            for var in [N_, M_, N, M]
+        ]
+        self.dt = dt
+        self.L = int(np.max(self.N_ + self.M_))
+        self.worms = np.arange(n)
+        self.c_t = np.empty((n, self.L), dtype=dtype)
+        self.c_t[:] = np.broadcast_to(c_init, self.shape).reshape(n, 1)
+        self.k = 0
+        self.on_sum = self.N_ * self.c_t[:, 0].astype(np.float64)
+        self.off_sum = self.M_ * self.c_t[:, 0].astype(np.float64)
+
+    def push(self, c):
+        """
+        c: 新しい濃度
+        """
+        p = self.k % self.L
+        c = np.reshape(c, -1)
+        c_on_to_off = self.c_t[self.worms, (p - self.N_) % self.L]
+        c_off_out = self.c_t[self.worms, (p - self.N_ - self.M_) % self.L]
+        self.on_sum += c - c_on_to_off
+        self.off_sum += c_on_to_off - c_off_out
+        self.c_t[:, p] = c
+        self.k += 1
+
+        # 丸め誤差の蓄積を防ぐため，バッファが一周するごとに窓の和を計算し直す
+        if p == self.L - 1:
+            c_cumsum = np.zeros((len(self.worms), self.L + 1))
+            np.cumsum(self.c_t, axis=1, dtype=np.float64, out=c_cumsum[:, 1:])
+            on_start = c_cumsum[self.worms, self.L - self.N_]
+            off_start = c_cumsum[self.worms, self.L - self.N_ - self.M_]
+            self.on_sum = c_cumsum[:, self.L] - on_start
+            self.off_sum = on_start - off_start
+
+    def y_on(self):
+        y_ = np.clip(self.on_sum / self.N - self.off_sum / self.M, 0, None)
+        return (y_ * 100 * self.dt).reshape(self.shape)
+
+    def y_off(self):
+        y_ = np.clip(self.off_sum / self.M - self.on_sum / self.N, 0, None)
+        return (y_ * 100 * self.dt).reshape(self.shape)
+
+
+class TimedSensoryHistory:
+    """
+    時刻つきの濃度の履歴（適応刻み幅のsimulate用）
+
+    受け取った時刻ごとに濃度の累積積分（台形則）を保持し，
+    ON窓（直近N秒）とOFF窓（その前のM秒）の平均を累積積分の差から求める
+    窓をステップ数ではなく時間で扱うので，時刻の間隔は一定でなくてよい
+    """
+
+    def __init__(self, c_init, N, M, t_0=0.0):
+        """
+        c_init: 時刻t_0の濃度（それ以前もこの濃度だったとする） (n,)
+        N, M: ON窓とOFF窓の時間 (n,)
+        t_0: 最初の時刻
+        """
+        self.c_init = np.array(c_init, dtype=float)
+        n = len(self.c_init)
+        self.N = np.array(np.broadcast_to(N, n), dtype=float)
+        self.M = np.array(np.broadcast_to(M, n), dtype=float)
+        self.window = float(np.max(self.N + self.M))
+        self.worms = np.arange(n)
+        self.times = np.empty(64)
+        self.cumulative = np.empty((n, 64))
+        self.times[0] = t_0
+        self.cumulative[:, 0] = 0
+        self.c_last = self.c_init.copy()
+        self.size = 1
+
+    def extend(self, t, c):
+        """
+        時刻tに濃度cとなったときの累積積分を返す（履歴は変更しない）
+        """
+        last = self.size - 1
+        return self.cumulative[:, last] + (self.c_last + c) / 2 * (t - self.times[last])
+
+    def push(self, t, c):
+        """
+        t: 新しい時刻（最後の時刻より後）
+        c: 新しい濃度 (n,)
+        """
+        cumulative = self.extend(t, c)
+        if self.size == len(self.times):
+            self.trim(t)
+        self.times[self.size] = t
+        self.cumulative[:, self.size] = cumulative
+        self.c_last = np.array(c, dtype=float)
+        self.size += 1
+
+    def trim(self, t):
+        """
+        窓より古い時刻を捨て（補間のため窓の外の1点は残す），足りなければ容量を倍にする
+        """
+        start = max(
+            int(np.searchsorted(self.times[: self.size], t - self.window)) - 1, 0
+        )
+        self.size -= start
+        self.times[: self.size] = self.times[start : start + self.size]
+        self.cumulative[:, : self.size] = self.cumulative[:, start : start + self.size]
+        if self.size > len(self.times) // 2:
+            self.times = np.resize(self.times, 2 * len(self.times))
+            cumulative = np.empty((len(self.worms), len(self.times)))
+            cumulative[:, : self.size] = self.cumulative[:, : self.size]
+            self.cumulative = cumulative
+
+    def integral(self, q, t_new, cumulative_new):
+        """
+        q: 累積積分を求める時刻 (n,)
+        t_new, cumulative_new: 最後の時刻より後の時刻とそこでの累積積分（extendの戻り値）
+
+        各ワームの時刻qでの累積積分を線形補間で返す
+        """
+        times = self.times[: self.size]
+        last = self.size - 1
+        before = self.cumulative[:, 0] + self.c_init * (q - times[0])
+        result = before
+        if last > 0:
+            i = np.clip(np.searchsorted(times, q), 1, last)
+            t_0, t_1 = times[i - 1], times[i]
+            c_0 = self.cumulative[self.worms, i - 1]
+            c_1 = self.cumulative[self.worms, i]
+            result = np.where(
+                q <= times[0], before, c_0 + (c_1 - c_0) * (q - t_0) / (t_1 - t_0)
+            )
+        if t_new > times[last]:
+            c_last = self.cumulative[:, last]
+            after = c_last + (cumulative_new - c_last) * (q - times[last]) / (
+                t_new - times[last]
+            )
+            result = np.where(q > times[last], after, result)
+        return result
+
+    def y_on_off(self, t, c):
+        """
+        t: 時刻（最後の時刻以降）
+        c: 時刻tの濃度 (n,)
+
+        時刻tに濃度cとなったときのON・OFFの感覚ニューロンの出力を返す
+        （SensoryHistoryの y_on, y_off の時間刻みを0に近づけた値）
+        """
+        cumulative = self.extend(t, c)
+        boundary = self.integral(t - self.N, t, cumulative)
+        on = (cumulative - boundary) / self.N
+        off = (boundary - self.integral(t - self.N - self.M, t, cumulative)) / self.M
+        return np.clip(on - off, 0, None) * 100, np.clip(off - on, 0, None) * 100
+
+
+class GridSensoryHistory:
+    """
+    一定の時間刻みで記録する時刻つきの濃度の履歴（rk4_block, exponential_euler_block用）
+
+    TimedSensoryHistoryと同じく濃度の累積積分（台形則）の差からON窓とOFF窓の平均を求める
+    時刻がdtの整数倍に限られるので，累積積分は事前に確保したリングバッファに保持し，
+    任意の時刻の累積積分を探索せずに補間する
+    """
+
+    def __init__(self, c_init, N, M, dt):
+        """
+        c_init: 時刻0の濃度（それ以前もこの濃度だったとする） (n,)
+        N, M: ON窓とOFF窓の時間 (n,)
+        dt: 時間刻み
+        """
+        self.c_init = np.array(c_init, dtype=float)
+        n = len(self.c_init)
+        self.N = np.array(np.broadcast_to(N, n), dtype=float)
+        self.M = np.array(np.broadcast_to(M, n), dtype=float)
+        self.dt = dt
+        # 窓の中の時刻と，補間のための前後の時刻を保持する
+        self.L = int(np.ceil(np.max(self.N + self.M) / dt)) + 3
+        self.worms = np.arange(n)
+        self.cumulative = np.zeros((n, self.L))
+        self.c_last = self.c_init.copy()
+        self.k = 0
+
+    def push(self, c):
+        """
+        c: 時刻 (k + 1) dt の濃度 (n,)
+        """
+        c = np.asarray(c, dtype=float)
+        self.cumulative[:, (self.k + 1) % self.L] = (
+            self.cumulative[:, self.k % self.L] + (self.c_last + c) / 2 * self.dt
+        )
+        self.c_last = c.copy()
+        self.k += 1
+
+    def integral(self, q, t_new, cumulative_new):
+        """
+        q: 累積積分を求める時刻 (n,)
+        t_new, cumulative_new: 最後の時刻以降の時刻とそこでの累積積分
+
+        各ワームの時刻qでの累積積分を線形補間で返す（TimedSensoryHistory.integralを参照）
+        """
+        t_last = self.k * self.dt
+        x = q / self.dt
+        i = np.clip(np.floor(x).astype(int), 0, max(self.k - 1, 0))
+        c_0 = self.cumulative[self.worms, i % self.L]
+        c_1 = self.cumulative[self.worms, (i + 1) % self.L]
+        result = np.where(q < 0, self.c_init * q, c_0 + (c_1 - c_0) * (x - i))
+        if t_new > t_last:
+            c_last = self.cumulative[:, self.k % self.L]
+            after = c_last + (cumulative_new - c_last) * (q - t_last) / (t_new - t_last)
+            result = np.where(q > t_last, after, result)
+        return result
+
+    def y_on_off(self, t, c):
+        """
+        t: 時刻（最後の時刻以降）
+        c: 時刻tの濃度 (n,)
+
+        時刻tに濃度cとなったときのON・OFFの感覚ニューロンの出力を返す
+        """
+        cumulative = self.cumulative[:, self.k % self.L] + (self.c_last + c) / 2 * (
+            t - self.k * self.dt
+        )
+        boundary = self.integral(t - self.N, t, cumulative)
+        on = (cumulative - boundary) / self.N
+        off = (boundary - self.integral(t - self.N - self.M, t, cumulative)) / self.M
+        return np.clip(on - off, 0, None) * 100, np.clip(off - on, 0, None) * 100
+
+
 def sigmoid(x):
     return np.exp(np.minimum(x, 0)) / (1 + np.exp(-np.abs(x)))
 
@@ -99,369 +350,2148 @@ def weight(gene):
     return N, M, theta, w_on, w_off, w, g, w_osc, w_nmj
 
 
-def constant(key):
-    settings = load.load_simulation_setting_toml("../python_scripts_setting.toml")
-    alpha = settings[key]["alpha"]
-    x_peak = settings[key]["x_peak"]
-    y_peak = settings[key]["y_peak"]
-    dt = settings[key]["dt"]
-    T = settings[key]["T"]
-    f = settings[key]["f"]
-    v = settings[key]["v"]
-    time = settings[key]["time"]
-    tau = settings[key]["tau"]
-    c_0 = settings[key]["c_0"]
-    lambda_ = settings[key]["lambda"]
+class Network(NamedTuple):
+    """
+    遺伝子をスケーリングしたネットワークのパラメータ（変更不可）
+    配列は書き込み禁止で，元の遺伝子・丸めの桁数・刻み幅が同じものは同一とみなす
+
+    N_, M_: 感覚ニューロンの時間のステップ数（dtを指定しない場合はNone）
+    a: ギャップ結合とリーク項をまとめた結合行列（coupling(g)，遺伝子ごとに1度だけ計算する）
+    """
+
+    N: float
+    M: float
+    theta: np.ndarray
+    w_on: np.ndarray
+    w_off: np.ndarray
+    w: np.ndarray
+    g: np.ndarray
+    w_osc: np.ndarray
+    w_nmj: float
+    N_: int
+    M_: int
+    a: np.ndarray
+    key: tuple
+
+    @property
+    def weights(self):
+        """
+        weight()と同じ順の (N, M, theta, w_on, w_off, w, g, w_osc, w_nmj)
+        """
+        return self[:9]
+
+    @property
+    def coupled_weights(self):
+        """
+        weightsのgを結合行列aに置き換えたもの（simulateの積分法に渡す順）
+        """
+        return (*self[:6], self.a, *self[7:9])
+
+    def __eq__(self, other):
+        return isinstance(other, Network) and self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+
+@functools.lru_cache(maxsize=1024)
+def decode_bytes(gene_bytes, decimal_places, dt):
+    weights = weight(np.frombuffer(gene_bytes))
+    if decimal_places:
+        weights = [np.round(var, decimal_places) for var in weights]
+    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = weights
+    a = coupling(g)
+    for var in [theta, w_on, w_off, w, g, w_osc, a]:
+        var.flags.writeable = False
+
+    N_ = M_ = None
+    if dt is not None:
+        # 時間に関する定数をステップ数に変換
+        N_ = int(np.floor(N / dt))
+        M_ = int(np.floor(M / dt))
+
+    return Network(
+        float(N),
+        float(M),
+        theta,
+        w_on,
+        w_off,
+        w,
+        g,
+        w_osc,
+        float(w_nmj),
+        N_,
+        M_,
+        a,
+        (gene_bytes, decimal_places, dt),
+    )
 
-    return alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_
 
+def decode(gene, decimal_places=None, dt=None):
+    """
+    gene: 遺伝子
+    decimal_places: パラメータを丸める小数点以下の桁数
+    dt: 刻み幅（指定した場合はN_, M_も計算する）
+
+    遺伝子をスケーリングしたNetworkを返す
+    同じ遺伝子はプロセスごとに1度だけスケーリングする
+    """
+    gene_bytes = np.asarray(gene, dtype=np.float64).tobytes()
+    return decode_bytes(gene_bytes, decimal_places or None, dt)
+
+
+def coupling(g):
+    """
+    g: ギャップ結合の重み (8, 8) または (n, 8, 8)
+
+    ギャップ結合のラプラシアンとリーク項をまとめた結合行列aを返す
+    wと同じ向き（a[j, i]はjからiへの結合）で，膜電位の更新では
+    -y + gap = a.T @ y となる
+    """
+    return g - g.sum(axis=-2)[..., None, :] * np.eye(8) - np.eye(8)
+
+
+SETTING_PATH = "../python_scripts_setting.toml"
+
+
+class Setting(NamedTuple):
+    """
+    python_scripts_setting.tomlの1セクション分の設定（変更不可）
+    タプルとして従来通り展開できる
+    """
+
+    alpha: float
+    x_peak: float
+    y_peak: float
+    dt: float
+    T: float
+    f: float
+    v: float
+    time: float
+    tau: float
+    c_0: float
+    lambda_: float
+
+
+# 設定ファイルのキャッシュ {パス: (更新時刻, tomlの内容, {セクション名: Setting})}
+setting_cache = {}
+
+
+def constant(key, file_path=SETTING_PATH):
+    """
+    key: 読み込むセクション名
+    file_path: 設定ファイルのパス
+
+    設定をSettingとして返す
+    ファイルはプロセスごとに1度だけ読み込み，更新時刻が変わった場合のみ読み直す
+    """
+    mtime = os.stat(file_path).st_mtime_ns
+    path = os.path.abspath(file_path)
+    if path not in setting_cache or setting_cache[path][0] != mtime:
+        settings = load.load_simulation_setting_toml(file_path)
+        setting_cache[path] = (mtime, settings, {})
+    mtime, settings, sections = setting_cache[path]
+
+    if key not in sections:
+        sections[key] = Setting(
+            alpha=float(settings[key]["alpha"]),
+            x_peak=float(settings[key]["x_peak"]),
+            y_peak=float(settings[key]["y_peak"]),
+            dt=float(settings[key]["dt"]),
+            T=float(settings[key]["T"]),
+            f=float(settings[key]["f"]),
+            v=float(settings[key]["v"]),
+            time=float(settings[key]["time"]),
+            tau=float(settings[key]["tau"]),
+            c_0=float(settings[key]["c_0"]),
+            lambda_=float(settings[key]["lambda"]),
+        )
 
-def time_constant_step(gene, key, decimal_places):
-    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = weight(gene)
-    if decimal_places:
-        N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = [
-            np.round(var, decimal_places)
-            for var in [N, M, theta, w_on, w_off, w, g, w_osc, w_nmj]
-        ]
-    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = constant(key)
+    return sections[key]
+
+
+def time_constant_step(gene, key, decimal_places, setting=None):
+    """
+    setting: 設定（Noneの場合はkeyのセクションを読み込む）
+    """
+    if setting is None:
+        setting = constant(key)
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    network = decode(gene, decimal_places, dt)
     # 時間に関する定数をステップ数に変換
-    N_ = np.floor(N / dt).astype(int)
-    M_ = np.floor(M / dt).astype(int)
+    N_ = network.N_
+    M_ = network.M_
     f_inv = np.floor(1 / f / dt).astype(int)
     T_ = np.floor(T / dt).astype(int)
 
     return N_, M_, f_inv, T_
 
 
-def klinotaxis(gene, mu_0, c_mode, decimal_places=None):
-    # 遺伝子の値をスケーリング
-    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = weight(gene)
+def concentration(c_mode, setting, x_, y_):
+    """
+    c_mode: 濃度関数の種類 (0: 線形, 1: ガウス, 2: 2つのガウス)
+    setting: 設定
+    x_, y_: 濃度を求める座標（配列も可）
+    """
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    if c_mode == 0:
+        return c_(alpha, x_, y_, x_peak, y_peak)
+    elif c_mode == 1:
+        return c_gauss(c_0, lambda_, x_, y_, x_peak, y_peak)
+    elif c_mode == 2:
+        return c_two_gauss(c_0, lambda_, x_, y_, x_peak, y_peak)
 
-    if decimal_places:
-        N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = [
-            np.round(var, decimal_places)
-            for var in [N, M, theta, w_on, w_off, w, g, w_osc, w_nmj]
-        ]
 
-    # tomlファイルの読み込み
-    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = constant("setting")
+def c_gradient(alpha, x_, y_, x_peak, y_peak):
+    d = np.sqrt((x_ - x_peak) ** 2 + (y_ - y_peak) ** 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return alpha * (x_ - x_peak) / d, alpha * (y_ - y_peak) / d
 
-    # 時間に関する定数をステップ数に変換
-    N_, M_, f_inv, T_ = time_constant_step(gene, "setting", decimal_places)
 
-    # 各種配列の初期化
-    t = np.arange(0, time, dt)
-    c_t = np.zeros(N_ + M_)
+def c_gauss_gradient(c_0, lambda_, x_, y_, x_peak, y_peak):
+    c = c_gauss(c_0, lambda_, x_, y_, x_peak, y_peak)
+    return -c * (x_ - x_peak) / lambda_**2, -c * (y_ - y_peak) / lambda_**2
+
+
+def c_two_gauss_gradient(c_0, lambda_, x_, y_, x_peak, y_peak):
+    c_plus = c_gauss(c_0, lambda_, x_, y_, x_peak, y_peak)
+    c_minus = c_gauss(c_0, lambda_, x_, y_, -x_peak, -y_peak)
+    return (
+        (-c_plus * (x_ - x_peak) + c_minus * (x_ + x_peak)) / lambda_**2,
+        (-c_plus * (y_ - y_peak) + c_minus * (y_ + y_peak)) / lambda_**2,
+    )
+
+
+def concentration_gradient(c_mode, setting, x_, y_):
+    """
+    c_mode: 濃度関数の種類 (0: 線形, 1: ガウス, 2: 2つのガウス)
+    setting: 設定
+    x_, y_: 勾配を求める座標（配列も可）
+
+    濃度の勾配 (x方向, y方向) を解析的に求める（線形の場合，ピーク上ではNaN）
+    """
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
     if c_mode == 0:
-        c_t[0 : N_ + M_] = c_(alpha, 0, 0, x_peak, y_peak)
+        return c_gradient(alpha, x_, y_, x_peak, y_peak)
     elif c_mode == 1:
-        c_t[0 : N_ + M_] = c_gauss(c_0, lambda_, 0, 0, x_peak, y_peak)
+        return c_gauss_gradient(c_0, lambda_, x_, y_, x_peak, y_peak)
     elif c_mode == 2:
-        c_t[0 : N_ + M_] = c_two_gauss(c_0, lambda_, 0, 0, x_peak, y_peak)
-    y = np.zeros((8, len(t)))
-    y[4:8, 0] = np.random.rand(4)  # 運動ニューロンの活性を0～1の範囲でランダム化
-    phi = np.zeros(len(t))
-    mu = np.zeros(len(t))
-    mu[0] = mu_0
-    r = np.zeros((2, len(t)))
-
-    # オイラー法
-    for k in range(len(t) - 1):
+        return c_two_gauss_gradient(c_0, lambda_, x_, y_, x_peak, y_peak)
+
+
+def point_concentration(x_, y_, c_mode, alpha, x_peak, y_peak, c_0, lambda_):
+    """
+    1点の濃度をスカラー演算で計算する（euler_kernel用）
+    """
+    d_0 = (x_ - x_peak) ** 2 + (y_ - y_peak) ** 2
+    if c_mode == 0:
+        return alpha * math.sqrt(d_0)
+    elif c_mode == 1:
+        return c_0 * math.exp(-d_0 / (2 * lambda_**2))
+    d_1 = (x_ + x_peak) ** 2 + (y_ + y_peak) ** 2
+    return c_0 * (math.exp(-d_0 / (2 * lambda_**2)) - math.exp(-d_1 / (2 * lambda_**2)))
+
+
+def euler_kernel(
+    y,
+    r,
+    mu,
+    c_t,
+    on_sum,
+    off_sum,
+    k_0,
+    n_steps,
+    t,
+    theta,
+    w_on,
+    w_off,
+    w,
+    a,
+    w_osc,
+    w_nmj,
+    N_,
+    M_,
+    N,
+    M,
+    c_mode,
+    alpha,
+    x_peak,
+    y_peak,
+    c_0,
+    lambda_,
+    dt,
+    T,
+    v,
+    tau,
+    f_inv,
+    pirouette_mu,
+    r_out,
+    y_out,
+):
+    """
+    euler_blockと同じ計算をスカラー演算のみで書いたカーネル
+    numbaがある場合はコンパイルして使い，状態と出力の配列をその場で書き換える
+    """
+    L = c_t.shape[1]
+    output = np.empty(8)
+    y_next = np.empty(8)
+
+    for n in range(y.shape[0]):
+        event = 0
+        for j in range(n_steps):
+            k = k_0 + j
+
+            # 現在の状態を記録
+            if r_out.shape[2] > 0:
+                r_out[n, 0, j] = r[n, 0]
+                r_out[n, 1, j] = r[n, 1]
+            if y_out.shape[2] > 0:
+                for i in range(8):
+                    y_out[n, i, j] = y[n, i]
+
+            # 濃度の更新（リングバッファと窓の和を逐次更新）
+            c = point_concentration(
+                r[n, 0], r[n, 1], c_mode, alpha, x_peak, y_peak, c_0, lambda_
+            )
+            p = k % L
+            c_on_to_off = c_t[n, (p - N_[n]) % L]
+            c_off_out = c_t[n, (p - N_[n] - M_[n]) % L]
+            on_sum[n] += c - c_on_to_off
+            off_sum[n] += c_on_to_off - c_off_out
+            c_t[n, p] = c
+            if p == L - 1:
+                # c_tがfloat32の場合も和はfloat64で計算する
+                on_sum[n] = 0.0
+                for i in range(L - N_[n], L):
+                    on_sum[n] += c_t[n, i]
+                off_sum[n] = 0.0
+                for i in range(L - N_[n] - M_[n], L - N_[n]):
+                    off_sum[n] += c_t[n, i]
+            y_on_ = max(on_sum[n] / N[n] - off_sum[n] / M[n], 0.0) * 100 * dt
+            y_off_ = max(off_sum[n] / M[n] - on_sum[n] / N[n], 0.0) * 100 * dt
+
+            # 各ニューロンの出力
+            for i in range(8):
+                x = y[n, i] + theta[n, i]
+                output[i] = math.exp(min(x, 0.0)) / (1 + math.exp(-abs(x)))
+
+            # 介在ニューロンおよび運動ニューロンの膜電位の更新
+            osc = math.sin(2 * math.pi * t[k] / T)
+            for i in range(8):
+                synapse_leak_gap = 0.0
+                for m in range(8):
+                    synapse_leak_gap += w[n, m, i] * output[m] + a[n, m, i] * y[n, m]
+                y_next[i] = (
+                    y[n, i]
+                    + (
+                        synapse_leak_gap
+                        + w_on[n, i] * y_on_
+                        + w_off[n, i] * y_off_
+                        + w_osc[n, i] * osc
+                    )
+                    / tau
+                    * dt
+                )
+            for i in range(8):
+                y[n, i] = y_next[i]
+
+            # ピルエットの再現
+            if f_inv > 0 and k % f_inv == f_inv - 1:
+                mu[n] = pirouette_mu[n, event]
+                event += 1
+
+            # 方向および位置の更新
+            phi = w_nmj[n] * (output[5] + output[6] - output[4] - output[7])
+            r[n, 0] += v * math.cos(mu[n]) * dt
+            r[n, 1] += v * math.sin(mu[n]) * dt
+            mu[n] += phi * dt
+
+
+def grid_integral(cumulative, k, dt, c_init, q, t_new, cumulative_new):
+    """
+    GridSensoryHistory.integralと同じ計算を1匹分のスカラー演算で行う（カーネル用）
+    cumulative: 1匹分の累積積分のリングバッファ (L,)
+    k: 最後の時刻のステップ
+    """
+    L = cumulative.shape[0]
+    t_last = k * dt
+    if q > t_last:
+        c_last = cumulative[k % L]
+        return c_last + (cumulative_new - c_last) * (q - t_last) / (t_new - t_last)
+    if q < 0:
+        return c_init * q
+    x = q / dt
+    i = min(math.floor(x), max(k - 1, 0))
+    c_0 = cumulative[i % L]
+    c_1 = cumulative[(i + 1) % L]
+    return c_0 + (c_1 - c_0) * (x - i)
+
+
+def grid_push(cumulative, c_last, n, k, c, dt):
+    """
+    GridSensoryHistory.pushと同じ計算を1匹分のスカラー演算で行う（カーネル用）
+    """
+    L = cumulative.shape[1]
+    cumulative[n, (k + 1) % L] = cumulative[n, k % L] + (c_last[n] + c) / 2 * dt
+    c_last[n] = c
+
+
+def point_input(
+    y_,
+    r_0,
+    r_1,
+    t_,
+    n,
+    k,
+    cumulative,
+    c_init,
+    c_last,
+    theta,
+    w_on,
+    w_off,
+    w,
+    w_osc,
+    w_nmj,
+    N,
+    M,
+    c_mode,
+    alpha,
+    x_peak,
+    y_peak,
+    c_0,
+    lambda_,
+    T,
+    dt,
+    tau,
+    output,
+    b,
+):
+    """
+    y_: n番目のワームの膜電位 (8,)
+    r_0, r_1: 位置
+    t_: 時刻
+    k: 濃度の履歴の最後の時刻のステップ
+    output, b: ニューロンの出力と入力を書き込む配列 (8,)
+
+    膜電位の線形項（リークとギャップ結合）以外の入力 b を書き込み，角速度を返す
+    （rk4_kernel, exponential_euler_kernel用）
+    感覚ニューロンの入力はGridSensoryHistory.y_on_offと同じく時間で定めた窓で求める
+    """
+    c = point_concentration(r_0, r_1, c_mode, alpha, x_peak, y_peak, c_0, lambda_)
+    L = cumulative.shape[1]
+    now = cumulative[n, k % L] + (c_last[n] + c) / 2 * (t_ - k * dt)
+    boundary = grid_integral(cumulative[n], k, dt, c_init[n], t_ - N[n], t_, now)
+    start = grid_integral(cumulative[n], k, dt, c_init[n], t_ - N[n] - M[n], t_, now)
+    on = (now - boundary) / N[n]
+    off = (boundary - start) / M[n]
+    y_on_ = max(on - off, 0.0) * 100
+    y_off_ = max(off - on, 0.0) * 100
+
+    for i in range(8):
+        x = y_[i] + theta[n, i]
+        output[i] = math.exp(min(x, 0.0)) / (1 + math.exp(-abs(x)))
+    osc = math.sin(2 * math.pi * t_ / T)
+    for i in range(8):
+        synapse = 0.0
+        for m in range(8):
+            synapse += w[n, m, i] * output[m]
+        b[i] = (
+            synapse + w_on[n, i] * y_on_ + w_off[n, i] * y_off_ + w_osc[n, i] * osc
+        ) / tau
+    return w_nmj[n] * (output[5] + output[6] - output[4] - output[7])
+
+
+def chord_length(turn, v, dt):
+    """
+    角速度一定で turn だけ向きを変えながら v dt だけ進んだときの弦の長さ
+    """
+    if turn == 0.0:
+        return v * dt
+    return v * dt * math.sin(turn / 2) / (turn / 2)
+
+
+def rk4_kernel(
+    y,
+    r,
+    mu,
+    cumulative,
+    c_init,
+    c_last,
+    k_0,
+    n_steps,
+    t,
+    theta,
+    w_on,
+    w_off,
+    w,
+    a,
+    w_osc,
+    w_nmj,
+    N,
+    M,
+    c_mode,
+    alpha,
+    x_peak,
+    y_peak,
+    c_0,
+    lambda_,
+    dt,
+    T,
+    v,
+    tau,
+    f_inv,
+    pirouette_mu,
+    r_out,
+    y_out,
+):
+    """
+    rk4_blockと同じ計算をスカラー演算のみで書いたカーネル
+    cumulative, c_init, c_last: GridSensoryHistoryの配列（その場で書き換える）
+    """
+    output = np.empty(8)
+    stage = np.empty(8)
+    # 最初の段は前の段の傾きに0を掛けるので，0で初期化しておく
+    dy = np.zeros((4, 8))
+    dmu = np.zeros(4)
+    dr = np.zeros((4, 2))
+    offset = (0.0, 0.5, 0.5, 1.0)
+
+    for n in range(y.shape[0]):
+        event = 0
+        for j in range(n_steps):
+            k = k_0 + j
+
+            # 現在の状態を記録
+            if r_out.shape[2] > 0:
+                r_out[n, 0, j] = r[n, 0]
+                r_out[n, 1, j] = r[n, 1]
+            if y_out.shape[2] > 0:
+                for i in range(8):
+                    y_out[n, i, j] = y[n, i]
+
+            # ピルエットの再現
+            if f_inv > 0 and k % f_inv == f_inv - 1:
+                mu[n] = pirouette_mu[n, event]
+                event += 1
+
+            # 膜電位，角度，位置を4段で進める
+            for s in range(4):
+                h = offset[s] * dt
+                p = max(s - 1, 0)
+                for i in range(8):
+                    stage[i] = y[n, i] + dy[p, i] * h
+                mu_ = mu[n] + dmu[p] * h
+                r_0 = r[n, 0] + dr[p, 0] * h
+                r_1 = r[n, 1] + dr[p, 1] * h
+                dmu[s] = point_input(
+                    stage,
+                    r_0,
+                    r_1,
+                    t[k] + h,
+                    n,
+                    k,
+                    cumulative,
+                    c_init,
+                    c_last,
+                    theta,
+                    w_on,
+                    w_off,
+                    w,
+                    w_osc,
+                    w_nmj,
+                    N,
+                    M,
+                    c_mode,
+                    alpha,
+                    x_peak,
+                    y_peak,
+                    c_0,
+                    lambda_,
+                    T,
+                    dt,
+                    tau,
+                    output,
+                    dy[s],
+                )
+                for i in range(8):
+                    leak_gap = 0.0
+                    for m in range(8):
+                        leak_gap += a[n, m, i] * stage[m]
+                    dy[s, i] += leak_gap / tau
+                dr[s, 0] = v * math.cos(mu_)
+                dr[s, 1] = v * math.sin(mu_)
+
+            for i in range(8):
+                y[n, i] += (dy[0, i] + 2 * dy[1, i] + 2 * dy[2, i] + dy[3, i]) * dt / 6
+            mu[n] += (dmu[0] + 2 * dmu[1] + 2 * dmu[2] + dmu[3]) * dt / 6
+            for i in range(2):
+                r[n, i] += (dr[0, i] + 2 * dr[1, i] + 2 * dr[2, i] + dr[3, i]) * dt / 6
+
+            # 濃度の更新
+            c = point_concentration(
+                r[n, 0], r[n, 1], c_mode, alpha, x_peak, y_peak, c_0, lambda_
+            )
+            grid_push(cumulative, c_last, n, k, c, dt)
+
+
+def exponential_euler_kernel(
+    y,
+    r,
+    mu,
+    cumulative,
+    c_init,
+    c_last,
+    k_0,
+    n_steps,
+    t,
+    theta,
+    w_on,
+    w_off,
+    w,
+    E,
+    Phi,
+    Phi_2,
+    w_osc,
+    w_nmj,
+    N,
+    M,
+    c_mode,
+    alpha,
+    x_peak,
+    y_peak,
+    c_0,
+    lambda_,
+    dt,
+    T,
+    v,
+    tau,
+    f_inv,
+    pirouette_mu,
+    r_out,
+    y_out,
+):
+    """
+    exponential_euler_blockと同じ計算をスカラー演算のみで書いたカーネル
+    cumulative, c_init, c_last: GridSensoryHistoryの配列（その場で書き換える）
+    E, Phi, Phi_2: ワームごとのexponential_propagatorの戻り値 (n, 8, 8)
+    """
+    output = np.empty(8)
+    b_1 = np.empty(8)
+    b_2 = np.empty(8)
+    y_predict = np.empty(8)
+
+    for n in range(y.shape[0]):
+        event = 0
+        for j in range(n_steps):
+            k = k_0 + j
+
+            # 現在の状態を記録
+            if r_out.shape[2] > 0:
+                r_out[n, 0, j] = r[n, 0]
+                r_out[n, 1, j] = r[n, 1]
+            if y_out.shape[2] > 0:
+                for i in range(8):
+                    y_out[n, i, j] = y[n, i]
+
+            # ピルエットの再現
+            if f_inv > 0 and k % f_inv == f_inv - 1:
+                mu[n] = pirouette_mu[n, event]
+                event += 1
+
+            # 入力を一定として予測し，終わりの入力との差で補正する
+            phi_1 = point_input(
+                y[n],
+                r[n, 0],
+                r[n, 1],
+                t[k],
+                n,
+                k,
+                cumulative,
+                c_init,
+                c_last,
+                theta,
+                w_on,
+                w_off,
+                w,
+                w_osc,
+                w_nmj,
+                N,
+                M,
+                c_mode,
+                alpha,
+                x_peak,
+                y_peak,
+                c_0,
+                lambda_,
+                T,
+                dt,
+                tau,
+                output,
+                b_1,
+            )
+            for i in range(8):
+                y_predict[i] = 0.0
+                for m in range(8):
+                    y_predict[i] += y[n, m] * E[n, m, i] + b_1[m] * Phi[n, m, i]
+            turn = phi_1 * dt
+            chord = chord_length(turn, v, dt)
+            phi_2 = point_input(
+                y_predict,
+                r[n, 0] + chord * math.cos(mu[n] + turn / 2),
+                r[n, 1] + chord * math.sin(mu[n] + turn / 2),
+                t[k] + dt,
+                n,
+                k,
+                cumulative,
+                c_init,
+                c_last,
+                theta,
+                w_on,
+                w_off,
+                w,
+                w_osc,
+                w_nmj,
+                N,
+                M,
+                c_mode,
+                alpha,
+                x_peak,
+                y_peak,
+                c_0,
+                lambda_,
+                T,
+                dt,
+                tau,
+                output,
+                b_2,
+            )
+            for i in range(8):
+                correction = 0.0
+                for m in range(8):
+                    correction += (b_2[m] - b_1[m]) * Phi_2[n, m, i]
+                y[n, i] = y_predict[i] + correction
+
+            # 方向および位置の更新
+            turn = (phi_1 + phi_2) / 2 * dt
+            chord = chord_length(turn, v, dt)
+            r[n, 0] += chord * math.cos(mu[n] + turn / 2)
+            r[n, 1] += chord * math.sin(mu[n] + turn / 2)
+            mu[n] += turn
+
+            # 濃度の更新
+            c = point_concentration(
+                r[n, 0], r[n, 1], c_mode, alpha, x_peak, y_peak, c_0, lambda_
+            )
+            grid_push(cumulative, c_last, n, k, c, dt)
+
+
+def compile_kernels():
+    """
+    numbaを読み込み，point_concentrationと各カーネルをコンパイル済みのものに置き換える
+    """
+    global point_concentration, euler_kernel, kernels_compiled
+    global grid_integral, grid_push, point_input, chord_length
+    global rk4_kernel, exponential_euler_kernel
+    if not kernels_compiled:
+        import numba
+
+        point_concentration = numba.njit(cache=True)(point_concentration)
+        euler_kernel = numba.njit(cache=True)(euler_kernel)
+        grid_integral = numba.njit(cache=True)(grid_integral)
+        grid_push = numba.njit(cache=True)(grid_push)
+        point_input = numba.njit(cache=True)(point_input)
+        chord_length = numba.njit(cache=True)(chord_length)
+        rk4_kernel = numba.njit(cache=True)(rk4_kernel)
+        exponential_euler_kernel = numba.njit(cache=True)(exponential_euler_kernel)
+        kernels_compiled = True
+
+
+def use_jit(jit=None):
+    """
+    jit: Trueでコンパイル済みカーネルを使用，Falseで使用しない，Noneで自動選択
+    """
+    if jit is None:
+        return numba_available
+    if jit and not numba_available:
+        raise ImportError("numba is required for jit=True")
+    return jit
+
+
+def batch_weight(genes, decimal_places=None):
+    """
+    genes: 遺伝子の配列 (22,) または (n, 22)
+
+    各遺伝子をスケーリングし，ワームごとのパラメータを先頭の軸に積み重ねて
+    (N, M, theta, w_on, w_off, w, a, w_osc, w_nmj) の順に返す（Network.coupled_weights）
+    遺伝子が1つの場合は行列をそのまま(8, 8)で返す
+    """
+    genes = np.asarray(genes, dtype=float)
+
+    # 同じ遺伝子は1度だけスケーリングし，結合行列もdecodeでキャッシュしたものを使う
+    unique_genes, inverse = np.unique(np.atleast_2d(genes), axis=0, return_inverse=True)
+    weights = [decode(gene, decimal_places).coupled_weights for gene in unique_genes]
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = [
+        np.array(var)[inverse.reshape(-1)] for var in zip(*weights)
+    ]
+    if genes.ndim == 1:
+        w, a = w[0], a[0]
+
+    return N, M, theta, w_on, w_off, w, a, w_osc, w_nmj
+
+
+def batch_dot(x, m):
+    """
+    x: 各ワームのベクトル (n, 8)
+    m: 共通の行列 (8, 8) またはワームごとの行列 (n, 8, 8)
+
+    ワームごとに x @ m を計算する
+    """
+    if m.ndim == 2:
+        return x @ m
+    return np.einsum("nj,nji->ni", x, m)
+
+
+def euler_block(
+    y,
+    r,
+    mu,
+    history,
+    k_0,
+    n_steps,
+    t,
+    weights,
+    c_mode,
+    setting,
+    f_inv,
+    pirouette_mu,
+    r_out,
+    y_out,
+):
+    """
+    y, r, mu: ワームごとの膜電位 (n, 8)，位置 (n, 2)，角度 (n,)（その場で更新する）
+    history: 濃度の履歴（SensoryHistory）
+    k_0: ブロックの最初のステップ
+    n_steps: 進めるステップ数
+    t: 時刻の配列
+    weights: batch_weightの戻り値（gの代わりに結合行列aが入る）
+    c_mode: 濃度関数の種類
+    setting: 設定
+    f_inv: ピルエットの間隔（ステップ数，0の場合はピルエットなし）
+    pirouette_mu: ブロック内のピルエット後の角度 (n, ピルエットの回数)
+    r_out, y_out: 各ステップの状態を記録する配列 (n, 2, ステップ数), (n, 8, ステップ数)
+                  （記録しない場合は最後の軸の長さを0にする）
+
+    オイラー法でn_stepsステップだけ進める
+    """
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = weights
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    event = 0
+
+    for j in range(n_steps):
+        k = k_0 + j
+
+        # 現在の状態を記録
+        if r_out.shape[2] > 0:
+            r_out[:, :, j] = r
+        if y_out.shape[2] > 0:
+            y_out[:, :, j] = y
+
         # シナプス結合およびギャップ結合からの入力
-        synapse = np.dot(w.T, sigmoid(y[:, k] + theta))
-        gap = np.array([np.dot(g[:, i], (y[:, k] - y[i, k])) for i in range(8)])
+        output = sigmoid(y + theta)
+        synapse = batch_dot(output, w)
+        leak_gap = batch_dot(y, a)
 
         # 濃度の更新
-        c_t = np.delete(c_t, 0)
-        if c_mode == 0:
-            c = c_(alpha, r[0, k], r[1, k], x_peak, y_peak)
-        elif c_mode == 1:
-            c = c_gauss(c_0, lambda_, r[0, k], r[1, k], x_peak, y_peak)
-        elif c_mode == 2:
-            c = c_two_gauss(c_0, lambda_, r[0, k], r[1, k], x_peak, y_peak)
-        c_t = np.append(c_t, c)
+        history.push(concentration(c_mode, setting, r[:, 0], r[:, 1]))
 
         # 介在ニューロンおよび運動ニューロンの膜電位の更新
-        y[:, k + 1] = (
-            y[:, k]
-            + (
-                -y[:, k]
+        y += (
+            (
+                leak_gap
                 + synapse
-                + gap
-                + w_on * y_on(c_t, N_, M_, N, M, dt)
-                + w_off * y_off(c_t, N_, M_, N, M, dt)
+                + w_on * history.y_on()[:, None]
+                + w_off * history.y_off()[:, None]
                 + w_osc * y_osc(t[k], T)
             )
             / tau
             * dt
         )
 
-        # 方向の更新
-        phi[k] = w_nmj * (
-            sigmoid(y[5, k] + theta[5])
-            + sigmoid(y[6, k] + theta[6])
-            - sigmoid(y[4, k] + theta[4])
-            - sigmoid(y[7, k] + theta[7])
+        # ピルエットの再現
+        if f_inv > 0 and k % f_inv == f_inv - 1:
+            mu[:] = pirouette_mu[:, event]
+            event += 1
+
+        # 方向および位置の更新
+        phi = w_nmj * (output[:, 5] + output[:, 6] - output[:, 4] - output[:, 7])
+        r[:, 0] += v * np.cos(mu) * dt
+        r[:, 1] += v * np.sin(mu) * dt
+        mu += phi * dt
+
+
+def rk4_block(
+    y,
+    r,
+    mu,
+    history,
+    k_0,
+    n_steps,
+    t,
+    weights,
+    c_mode,
+    setting,
+    f_inv,
+    pirouette_mu,
+    r_out,
+    y_out,
+):
+    """
+    euler_blockと同じ引数をとり，4次のルンゲ＝クッタ法でn_stepsステップだけ進める
+    history には一定の時間刻みの濃度の履歴（GridSensoryHistory）を渡す
+    感覚ニューロンの入力は各段の時刻と位置の濃度から時間で定めた窓で求める
+    （ステップ数の窓では刻み幅を大きくしたときの誤差が積分法によらず残る）
+    """
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = weights
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    event = 0
+
+    def derivative(t_, y_, mu_, r_):
+        c = concentration(c_mode, setting, r_[:, 0], r_[:, 1])
+        y_on_, y_off_ = history.y_on_off(t_, c)
+        output = sigmoid(y_ + theta)
+        dy = (
+            batch_dot(y_, a)
+            + batch_dot(output, w)
+            + w_on * y_on_[:, None]
+            + w_off * y_off_[:, None]
+            + w_osc * y_osc(t_, T)
         )
-        mu[k + 1] = mu[k] + phi[k] * dt
+        dmu = w_nmj * (output[:, 5] + output[:, 6] - output[:, 4] - output[:, 7])
+        dr = v * np.stack([np.cos(mu_), np.sin(mu_)], axis=1)
+        return dy / tau, dmu, dr
+
+    for j in range(n_steps):
+        k = k_0 + j
 
-        # 位置の更新
-        r[0, k + 1], r[1, k + 1] = (
-            r[0, k] + v * np.cos(mu[k]) * dt,
-            r[1, k] + v * np.sin(mu[k]) * dt,
+        # 現在の状態を記録
+        if r_out.shape[2] > 0:
+            r_out[:, :, j] = r
+        if y_out.shape[2] > 0:
+            y_out[:, :, j] = y
+
+        # ピルエットの再現
+        if f_inv > 0 and k % f_inv == f_inv - 1:
+            mu[:] = pirouette_mu[:, event]
+            event += 1
+
+        # 膜電位，角度，位置を4段で進める
+        dy_1, dmu_1, dr_1 = derivative(t[k], y, mu, r)
+        dy_2, dmu_2, dr_2 = derivative(
+            t[k] + dt / 2, y + dy_1 * dt / 2, mu + dmu_1 * dt / 2, r + dr_1 * dt / 2
         )
+        dy_3, dmu_3, dr_3 = derivative(
+            t[k] + dt / 2, y + dy_2 * dt / 2, mu + dmu_2 * dt / 2, r + dr_2 * dt / 2
+        )
+        dy_4, dmu_4, dr_4 = derivative(
+            t[k] + dt, y + dy_3 * dt, mu + dmu_3 * dt, r + dr_3 * dt
+        )
+        y += (dy_1 + 2 * dy_2 + 2 * dy_3 + dy_4) * dt / 6
+        mu += (dmu_1 + 2 * dmu_2 + 2 * dmu_3 + dmu_4) * dt / 6
+        r += (dr_1 + 2 * dr_2 + 2 * dr_3 + dr_4) * dt / 6
 
-    return r
+        # 濃度の更新
+        history.push(concentration(c_mode, setting, r[:, 0], r[:, 1]))
+
+
+def exponential_propagator(a, tau, dt):
+    """
+    a: 結合行列 (8, 8) または (n, 8, 8)（ギャップ結合は対称なので対称行列）
+    tau: 時定数
+    dt: 時間刻み
+
+    線形項 y' = y @ a / tau を厳密に解く行列 E = exp(a dt / tau) と，
+    入力bを積分する行列 Phi = (E - I) L^-1, Phi_2 = (E - I - L dt) L^-2 / dt
+    （L = a / tau）を返す
+    bが一定なら y(t + dt) = y @ E + b @ Phi，
+    bが線形に変化するなら b(t + dt) - b(t) の分だけ @ Phi_2 を加える
+    """
+    eigenvalues, vectors = np.linalg.eigh(a / tau)
+    transposed = np.swapaxes(vectors, -1, -2)
+    E = (vectors * np.exp(eigenvalues * dt)[..., None, :]) @ transposed
+    # aの固有値は-1以下なので0で割ることはない
+    Phi = (
+        vectors * (np.expm1(eigenvalues * dt) / eigenvalues)[..., None, :]
+    ) @ transposed
+    Phi_2 = (
+        vectors
+        * ((np.expm1(eigenvalues * dt) - eigenvalues * dt) / (eigenvalues**2 * dt))[
+            ..., None, :
+        ]
+    ) @ transposed
+    return E, Phi, Phi_2
+
+
+def exponential_euler_block(
+    y,
+    r,
+    mu,
+    history,
+    k_0,
+    n_steps,
+    t,
+    weights,
+    c_mode,
+    setting,
+    f_inv,
+    pirouette_mu,
+    r_out,
+    y_out,
+):
+    """
+    euler_blockと同じ引数をとり，2次の指数オイラー法（ETD2RK）でn_stepsステップだけ進める
+    history には一定の時間刻みの濃度の履歴（GridSensoryHistory）を渡す
+    リーク項とギャップ結合の線形項は行列指数関数で厳密に解き，
+    シナプス結合・感覚ニューロン・振動成分の入力はステップの始めと
+    予測子（入力を一定とした指数オイラー法）の終わりの値を線形に補間する
+    感覚ニューロンの入力は時間で定めた窓で求める
+    位置は角速度を一定とした円弧に沿って進め，角速度は始めと終わりの平均とする
+    """
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = weights
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    E, Phi, Phi_2 = [m.astype(y.dtype) for m in exponential_propagator(a, tau, dt)]
+    event = 0
+
+    def nonlinear(t_, y_, r_):
+        # 線形項以外の入力 b と角速度
+        c = concentration(c_mode, setting, r_[:, 0], r_[:, 1])
+        y_on_, y_off_ = history.y_on_off(t_, c)
+        output = sigmoid(y_ + theta)
+        b = (
+            batch_dot(output, w)
+            + w_on * y_on_[:, None]
+            + w_off * y_off_[:, None]
+            + w_osc * y_osc(t_, T)
+        ) / tau
+        phi = w_nmj * (output[:, 5] + output[:, 6] - output[:, 4] - output[:, 7])
+        return b, phi
+
+    def arc(turn):
+        # 角速度一定で turn だけ向きを変えたときの変位（弦の長さ v dt sinc，向きは中点の角度）
+        chord = v * dt * np.sinc(turn / (2 * np.pi))
+        return chord[:, None] * np.stack(
+            [np.cos(mu + turn / 2), np.sin(mu + turn / 2)], axis=1
+        )
 
+    for j in range(n_steps):
+        k = k_0 + j
 
-def klinotaxis_random(gene):
-    # 遺伝子の値をスケーリング
-    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = weight(gene)
+        # 現在の状態を記録
+        if r_out.shape[2] > 0:
+            r_out[:, :, j] = r
+        if y_out.shape[2] > 0:
+            y_out[:, :, j] = y
 
-    # tomlファイルの読み込み
-    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = constant("setting")
+        # ピルエットの再現
+        if f_inv > 0 and k % f_inv == f_inv - 1:
+            mu[:] = pirouette_mu[:, event]
+            event += 1
 
-    # 時間に関する定数をステップ数に変換
-    N_, M_, f_inv, T_ = time_constant_step(gene, "setting")
+        # 入力を一定として予測し，終わりの入力との差で補正する
+        b_1, phi_1 = nonlinear(t[k], y, r)
+        y_predict = batch_dot(y, E) + batch_dot(b_1, Phi)
+        b_2, phi_2 = nonlinear(t[k] + dt, y_predict, r + arc(phi_1 * dt))
+        y[:] = y_predict + batch_dot(b_2 - b_1, Phi_2)
 
-    # 各種配列の初期化
-    t = np.arange(0, time, dt)
-    c_t = np.zeros(N_ + M_)
-    c_t[0 : N_ + M_] = c_(alpha, 0, 0, x_peak, y_peak)
-    y = np.zeros((8, len(t)))
-    y[4:8, 0] = np.random.rand(4)  # 運動ニューロンの活性を0～1の範囲でランダム化
-    phi = np.zeros(len(t))
-    mu = np.zeros(len(t))
-    mu[0] = random.uniform(0, 2 * np.pi)  # ランダムな向きで配置
-    r = np.zeros((2, len(t)))
-
-    # オイラー法
-    for k in range(len(t) - 1):
-        # シナプス結合およびギャップ結合からの入力
-        synapse = np.dot(w.T, sigmoid(y[:, k] + theta))
-        gap = np.array([np.dot(g[:, i], (y[:, k] - y[i, k])) for i in range(8)])
+        # 方向および位置の更新
+        turn = (phi_1 + phi_2) / 2 * dt
+        r += arc(turn)
+        mu += turn
 
         # 濃度の更新
-        c_t = np.delete(c_t, 0)
-        c_t = np.append(c_t, c_(alpha, r[0, k], r[1, k], x_peak, y_peak))
+        history.push(concentration(c_mode, setting, r[:, 0], r[:, 1]))
+
+
+# simulateのmethodで選べる積分法（NumPyによる実装，コンパイル済みカーネルはKERNELS）
+INTEGRATORS = {
+    "euler": euler_block,
+    "rk4": rk4_block,
+    "exponential_euler": exponential_euler_block,
+}
+
+
+# Dormand-Prince法（5次と4次の埋め込み型ルンゲ＝クッタ法）の係数
+DORMAND_PRINCE_C = [0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1, 1]
+DORMAND_PRINCE_A = [
+    [],
+    [1 / 5],
+    [3 / 40, 9 / 40],
+    [44 / 45, -56 / 15, 32 / 9],
+    [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+    [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+]
+# 5次と4次の解の差（誤差の推定）の係数
+DORMAND_PRINCE_E = [
+    71 / 57600,
+    0,
+    -71 / 16695,
+    71 / 1920,
+    -17253 / 339200,
+    22 / 525,
+    -1 / 40,
+]
+
+
+def adaptive_run(
+    y,
+    r,
+    mu,
+    weights,
+    c_mode,
+    setting,
+    t,
+    f_inv,
+    rng,
+    recorders,
+    block_size,
+    tolerance,
+    max_dt=None,
+):
+    """
+    y, r, mu: ワームごとの膜電位 (n, 8)，位置 (n, 2)，角度 (n,)（初期値）
+    weights: batch_weightの戻り値（gの代わりに結合行列aが入る）
+    c_mode: 濃度関数の種類
+    setting: 設定（dtは記録する時刻の間隔として使う）
+    t: 記録する時刻の配列
+    f_inv: ピルエットの間隔（記録のステップ数，0の場合はピルエットなし）
+    rng: ピルエット後の角度を決める乱数生成器
+    recorders: レコーダーのリスト（startを呼んだもの）
+    block_size: レコーダーに一度に渡す記録の数
+    tolerance: 1ステップあたりの誤差の許容値（膜電位と位置は大きさに対する相対値，
+               角度は絶対値）
+    max_dt: 刻み幅の上限（Noneの場合はニューロンの時定数tau）
+
+    すべてのワームに共通の刻み幅をDormand-Prince法の誤差推定で調整しながら進め，
+    t の各時刻の状態を3次エルミート補間で求めてレコーダーに渡す
+    濃度の履歴はTimedSensoryHistoryで時刻とともに保持し，
+    振動が滑らかな間は大きな刻み幅で進める
+    """
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = weights
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    if max_dt is None:
+        max_dt = tau
+    n = len(y)
+    history = TimedSensoryHistory(
+        np.full(n, concentration(c_mode, setting, 0, 0)), N, M
+    )
 
-        # 介在ニューロンおよび運動ニューロンの膜電位の更新
-        y[:, k + 1] = (
-            y[:, k]
-            + (
-                -y[:, k]
-                + synapse
-                + gap
-                + w_on * y_on(c_t, N_, M_, N, M, dt)
-                + w_off * y_off(c_t, N_, M_, N, M, dt)
-                + w_osc * y_osc(t[k], T)
+    # 状態を (n, 11) にまとめる（膜電位8, 角度1, 位置2）
+    state = np.concatenate([y, mu[:, None], r], axis=1)
+    scale_mask = np.ones(11)
+    scale_mask[8] = 0
+
+    def derivative(t_, state_):
+        y_, mu_ = state_[:, :8], state_[:, 8]
+        c = concentration(c_mode, setting, state_[:, 9], state_[:, 10])
+        y_on_, y_off_ = history.y_on_off(t_, c)
+        output = sigmoid(y_ + theta)
+        d_state = np.empty_like(state_)
+        d_state[:, :8] = (
+            batch_dot(y_, a)
+            + batch_dot(output, w)
+            + w_on * y_on_[:, None]
+            + w_off * y_off_[:, None]
+            + w_osc * y_osc(t_, T)
+        ) / tau
+        d_state[:, 8] = w_nmj * (
+            output[:, 5] + output[:, 6] - output[:, 4] - output[:, 7]
+        )
+        d_state[:, 9] = v * np.cos(mu_)
+        d_state[:, 10] = v * np.sin(mu_)
+        return d_state, c
+
+    needs = {recorder.needs for recorder in recorders}
+    r_out = np.empty((n, 2, block_size if "r" in needs else 0))
+    y_out = np.empty((n, 8, block_size if "y" in needs else 0))
+    filled = 0
+    k_0 = 0
+
+    def emit(samples):
+        # 補間した状態 (n, 11, m) をブロックにためてレコーダーに渡す
+        nonlocal filled
+        j = 0
+        while j < samples.shape[2]:
+            m = min(block_size - filled, samples.shape[2] - j)
+            if r_out.shape[2] > 0:
+                r_out[:, :, filled : filled + m] = samples[:, 9:11, j : j + m]
+            if y_out.shape[2] > 0:
+                y_out[:, :, filled : filled + m] = samples[:, :8, j : j + m]
+            filled += m
+            j += m
+            if filled == block_size:
+                flush()
+
+    def flush():
+        nonlocal filled, k_0
+        for recorder in recorders:
+            recorder.record(k_0, r_out[:, :, :filled], y_out[:, :, :filled])
+        k_0 += filled
+        filled = 0
+
+    t_now = 0.0
+    d_state, _ = derivative(t_now, state)
+    emit(state[:, :, None])
+    k_next = 1
+    next_event = (f_inv - 1) * dt if f_inv > 0 else np.inf
+    h = min(max_dt, dt)
+
+    while k_next < len(t):
+        h = min(h, max_dt, t[-1] - t_now)
+        if next_event > t_now:
+            h = min(h, next_event - t_now)
+
+        # 各段の傾き（最後の段は5次の解での傾きで，次のステップの最初の段になる）
+        slopes = [d_state]
+        for i in range(1, 7):
+            stage = state + h * sum(
+                coef * slope for coef, slope in zip(DORMAND_PRINCE_A[i], slopes)
             )
-            / tau
-            * dt
+            slope, c_new = derivative(t_now + DORMAND_PRINCE_C[i] * h, stage)
+            slopes.append(slope)
+        state_new = stage
+        error = h * sum(coef * slope for coef, slope in zip(DORMAND_PRINCE_E, slopes))
+        scale = tolerance * (
+            1 + np.maximum(np.abs(state), np.abs(state_new)) * scale_mask
         )
+        error_norm = np.max(np.sqrt(np.mean((error / scale) ** 2, axis=1)))
+
+        if error_norm <= 1:
+            t_new = t_now + h
+            # このステップに含まれる記録の時刻を3次エルミート補間で求める
+            k_end = int(np.searchsorted(t, t_new, side="right"))
+            if k_end > k_next:
+                s = (t[k_next:k_end] - t_now) / h
+                emit(
+                    state[:, :, None] * (2 * s**3 - 3 * s**2 + 1)
+                    + d_state[:, :, None] * h * (s**3 - 2 * s**2 + s)
+                    + state_new[:, :, None] * (-2 * s**3 + 3 * s**2)
+                    + slopes[-1][:, :, None] * h * (s**3 - s**2)
+                )
+                k_next = k_end
+            history.push(t_new, c_new)
+            state, d_state, t_now = state_new, slopes[-1], t_new
+
+            # ピルエットの再現
+            if np.isclose(t_now, next_event):
+                state[:, 8] = rng.uniform(0, 2 * np.pi, n)
+                d_state, _ = derivative(t_now, state)
+                next_event += f_inv * dt
+
+        factor = 0.9 * max(error_norm, 1e-10) ** (-1 / 5)
+        h *= min(5.0, max(0.2, factor)) if error_norm <= 1 else max(0.2, factor)
+        if h < 1e-12:
+            raise RuntimeError("step size became too small")
+
+    if filled > 0:
+        flush()
+
+
+def kernel_weights(weights, n):
+    """
+    weights: batch_weightの戻り値（gの代わりに結合行列aが入る）
+    n: ワームの数
+
+    カーネルに渡せるよう，重みをワームごとの連続した配列に揃える
+    """
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = weights
+    theta, w_on, w_off, w_osc = [
+        np.ascontiguousarray(np.broadcast_to(var, (n, 8)))
+        for var in [theta, w_on, w_off, w_osc]
+    ]
+    w, a = [np.ascontiguousarray(np.broadcast_to(var, (n, 8, 8))) for var in [w, a]]
+    w_nmj = np.ascontiguousarray(np.broadcast_to(w_nmj, n))
+    return N, M, theta, w_on, w_off, w, a, w_osc, w_nmj
+
+
+def run_euler_kernel(
+    y,
+    r,
+    mu,
+    history,
+    k_0,
+    n_steps,
+    t,
+    weights,
+    c_mode,
+    setting,
+    f_inv,
+    pirouette_mu,
+    r_out,
+    y_out,
+):
+    """
+    euler_blockと同じ引数をとり，型と形を揃えてeuler_kernelを呼び出す
+    """
+    compile_kernels()
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = kernel_weights(weights, len(y))
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    euler_kernel(
+        y,
+        r,
+        mu,
+        history.c_t,
+        history.on_sum,
+        history.off_sum,
+        k_0,
+        n_steps,
+        t,
+        theta,
+        w_on,
+        w_off,
+        w,
+        a,
+        w_osc,
+        w_nmj,
+        history.N_,
+        history.M_,
+        history.N,
+        history.M,
+        int(c_mode),
+        alpha,
+        x_peak,
+        y_peak,
+        c_0,
+        lambda_,
+        dt,
+        T,
+        v,
+        tau,
+        int(f_inv),
+        pirouette_mu,
+        r_out,
+        y_out,
+    )
+    history.k += n_steps
+
+
+def run_rk4_kernel(
+    y,
+    r,
+    mu,
+    history,
+    k_0,
+    n_steps,
+    t,
+    weights,
+    c_mode,
+    setting,
+    f_inv,
+    pirouette_mu,
+    r_out,
+    y_out,
+):
+    """
+    rk4_blockと同じ引数をとり，型と形を揃えてrk4_kernelを呼び出す
+    """
+    compile_kernels()
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = kernel_weights(weights, len(y))
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    rk4_kernel(
+        y,
+        r,
+        mu,
+        history.cumulative,
+        history.c_init,
+        history.c_last,
+        k_0,
+        n_steps,
+        t,
+        theta,
+        w_on,
+        w_off,
+        w,
+        a,
+        w_osc,
+        w_nmj,
+        history.N,
+        history.M,
+        int(c_mode),
+        alpha,
+        x_peak,
+        y_peak,
+        c_0,
+        lambda_,
+        dt,
+        T,
+        v,
+        tau,
+        int(f_inv),
+        pirouette_mu,
+        r_out,
+        y_out,
+    )
+    history.k += n_steps
+
+
+def run_exponential_euler_kernel(
+    y,
+    r,
+    mu,
+    history,
+    k_0,
+    n_steps,
+    t,
+    weights,
+    c_mode,
+    setting,
+    f_inv,
+    pirouette_mu,
+    r_out,
+    y_out,
+):
+    """
+    exponential_euler_blockと同じ引数をとり，型と形を揃えてexponential_euler_kernelを呼び出す
+    """
+    compile_kernels()
+    n = len(y)
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = kernel_weights(weights, n)
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    E, Phi, Phi_2 = [
+        np.ascontiguousarray(np.broadcast_to(m, (n, 8, 8)), dtype=y.dtype)
+        for m in exponential_propagator(a, tau, dt)
+    ]
+    exponential_euler_kernel(
+        y,
+        r,
+        mu,
+        history.cumulative,
+        history.c_init,
+        history.c_last,
+        k_0,
+        n_steps,
+        t,
+        theta,
+        w_on,
+        w_off,
+        w,
+        E,
+        Phi,
+        Phi_2,
+        w_osc,
+        w_nmj,
+        history.N,
+        history.M,
+        int(c_mode),
+        alpha,
+        x_peak,
+        y_peak,
+        c_0,
+        lambda_,
+        dt,
+        T,
+        v,
+        tau,
+        int(f_inv),
+        pirouette_mu,
+        r_out,
+        y_out,
+    )
+    history.k += n_steps
 
-        # ピルエットの再現
-        if k % f_inv == f_inv - 1:
-            mu[k] = random.uniform(0, 2 * np.pi)
-
-        # 方向の更新
-        phi[k] = w_nmj * (
-            sigmoid(y[5, k] + theta[5])
-            + sigmoid(y[6, k] + theta[6])
-            - sigmoid(y[4, k] + theta[4])
-            - sigmoid(y[7, k] + theta[7])
-        )
-        mu[k + 1] = mu[k] + phi[k] * dt
 
-        # 位置の更新
-        r[0, k + 1], r[1, k + 1] = (
-            r[0, k] + v * np.cos(mu[k]) * dt,
-            r[1, k] + v * np.sin(mu[k]) * dt,
-        )
+# use_jitの場合に使うコンパイル済みカーネル
+KERNELS = {
+    "euler": run_euler_kernel,
+    "rk4": run_rk4_kernel,
+    "exponential_euler": run_exponential_euler_kernel,
+}
 
-    return r
 
+class PositionRecorder:
+    """
+    位置を記録するレコーダー
+    stride: 記録するステップの間隔（1の場合はすべてのステップ）
 
-def klinotaxis_membrane_potential(gene, mu_0, c_mode):
-    # 遺伝子の値をスケーリング
-    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = weight(gene)
+    結果は (n, 2, ceil(len(t) / stride))（型はsimulateのdtype）
+    """
 
-    # tomlファイルの読み込み
-    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = constant("setting")
+    needs = "r"
+    channels = 2
 
-    # 時間に関する定数をステップ数に変換
-    N_, M_, f_inv, T_ = time_constant_step(gene, "setting")
+    def __init__(self, stride=1):
+        self.stride = stride
 
-    # 各種配列の初期化
-    t = np.arange(0, time, dt)
-    c_t = np.zeros(N_ + M_)
-    if c_mode == 0:
-        c_t[0 : N_ + M_] = c_(alpha, 0, 0, x_peak, y_peak)
-    elif c_mode == 1:
-        c_t[0 : N_ + M_] = c_gauss(c_0, lambda_, 0, 0, x_peak, y_peak)
-    elif c_mode == 2:
-        c_t[0 : N_ + M_] = c_two_gauss(c_0, lambda_, 0, 0, x_peak, y_peak)
-    y = np.zeros((8, len(t)))
-    y[4:8, 0] = np.random.rand(4)  # 運動ニューロンの活性を0～1の範囲でランダム化
-    phi = np.zeros(len(t))
-    mu = np.zeros(len(t))
-    mu[0] = mu_0
-    r = np.zeros((2, len(t)))
-
-    # オイラー法
-    for k in range(len(t) - 1):
-        # シナプス結合およびギャップ結合からの入力
-        synapse = np.dot(w.T, sigmoid(y[:, k] + theta))
-        gap = np.array([np.dot(g[:, i], (y[:, k] - y[i, k])) for i in range(8)])
+    def start(self, n, steps, setting):
+        self.shape = (n, self.channels, -(-steps // self.stride))
+        self.data = None
 
-        # 濃度の更新
-        c_t = np.delete(c_t, 0)
-        if c_mode == 0:
-            c = c_(alpha, r[0, k], r[1, k], x_peak, y_peak)
-        elif c_mode == 1:
-            c = c_gauss(c_0, lambda_, r[0, k], r[1, k], x_peak, y_peak)
-        elif c_mode == 2:
-            c = c_two_gauss(c_0, lambda_, r[0, k], r[1, k], x_peak, y_peak)
-        c_t = np.append(c_t, c)
+    def record(self, k_0, r, y):
+        # ブロック内でstrideの倍数にあたるステップを取り出す
+        signal = r if self.needs == "r" else y
+        if self.data is None:
+            self.data = np.empty(self.shape, dtype=signal.dtype)
+        block = signal[:, :, -k_0 % self.stride :: self.stride]
+        i = -(-k_0 // self.stride)
+        self.data[:, :, i : i + block.shape[2]] = block
 
-        # 介在ニューロンおよび運動ニューロンの膜電位の更新
-        y[:, k + 1] = (
-            y[:, k]
-            + (
-                -y[:, k]
-                + synapse
-                + gap
-                + w_on * y_on(c_t, N_, M_, N, M, dt)
-                + w_off * y_off(c_t, N_, M_, N, M, dt)
-                + w_osc * y_osc(t[k], T)
-            )
-            / tau
-            * dt
-        )
+    def result(self):
+        if self.data is None:
+            self.data = np.empty(self.shape)
+        return self.data
 
-        # 方向の更新
-        phi[k] = w_nmj * (
-            sigmoid(y[5, k] + theta[5])
-            + sigmoid(y[6, k] + theta[6])
-            - sigmoid(y[4, k] + theta[4])
-            - sigmoid(y[7, k] + theta[7])
-        )
-        mu[k + 1] = mu[k] + phi[k] * dt
 
-        # 位置の更新
-        r[0, k + 1], r[1, k + 1] = (
-            r[0, k] + v * np.cos(mu[k]) * dt,
-            r[1, k] + v * np.sin(mu[k]) * dt,
+class MembranePotentialRecorder(PositionRecorder):
+    """
+    膜電位を記録するレコーダー
+    stride: 記録するステップの間隔（1の場合はすべてのステップ）
+
+    結果は (n, 8, ceil(len(t) / stride))（型はsimulateのdtype）
+    """
+
+    needs = "y"
+    channels = 8
+
+
+class CIRecorder:
+    """
+    軌跡を保存せずにCIを逐次計算するレコーダー
+    ピークまでの距離の和だけを保持する
+
+    結果は (n,)（ciと同じ値）
+    """
+
+    needs = "r"
+
+    def start(self, n, steps, setting):
+        self.setting = setting
+        self.distance_sum = np.zeros(n)
+
+    def record(self, k_0, r, y):
+        self.distance_sum += np.sum(
+            peak_distance(r, self.setting), axis=-1, dtype=np.float64
         )
 
-    return r, y
+    def result(self):
+        return ci_from_distance_sum(self.distance_sum, self.setting)
 
 
-def klinotaxis_animation(gene, mu_0, c_mode):
-    # 遺伝子の値をスケーリング
-    N, M, theta, w_on, w_off, w, g, w_osc, w_nmj = weight(gene)
+class BoundsRecorder:
+    """
+    軌跡を保存せずに位置の範囲を逐次計算するレコーダー
+
+    結果は (n, 4)（各ワームの x の最小値，x の最大値，y の最小値，y の最大値）
+    """
+
+    needs = "r"
+
+    def start(self, n, steps, setting):
+        self.r_min = np.full((n, 2), np.inf)
+        self.r_max = np.full((n, 2), -np.inf)
+
+    def record(self, k_0, r, y):
+        self.r_min = np.minimum(self.r_min, np.min(r, axis=-1))
+        self.r_max = np.maximum(self.r_max, np.max(r, axis=-1))
+
+    def result(self):
+        return np.stack(
+            [self.r_min[:, 0], self.r_max[:, 0], self.r_min[:, 1], self.r_max[:, 1]],
+            axis=-1,
+        )
+
+
+class EndpointRecorder:
+    """
+    最後の時刻の位置だけを記録するレコーダー
+
+    結果は (n, 2)
+    """
+
+    needs = "r"
+
+    def start(self, n, steps, setting):
+        self.r = np.full((n, 2), np.nan)
+
+    def record(self, k_0, r, y):
+        if r.shape[2] > 0:
+            self.r = r[:, :, -1].astype(np.float64)
+
+    def result(self):
+        return self.r
+
+
+def simulate(
+    genes,
+    mu_0,
+    c_mode,
+    recorders,
+    decimal_places=None,
+    pirouette=False,
+    jit=None,
+    setting=None,
+    block_size=1000,
+    seed=None,
+    method="euler",
+    tolerance=1e-6,
+    max_dt=None,
+    dtype=np.float64,
+):
+    """
+    genes: 遺伝子 (22,) または ワームごとの遺伝子 (n, 22)
+    mu_0: 初期角度 (スカラー または (n,))
+    c_mode: 濃度関数の種類 (0: 線形, 1: ガウス, 2: 2つのガウス)
+    recorders: 記録する信号のレコーダーのリスト（PositionRecorder,
+               MembranePotentialRecorder, CIRecorder, BoundsRecorderなど）
+    decimal_places: パラメータを丸める小数点以下の桁数
+    pirouette: Trueの場合，平均間隔1/fでランダムな向きに方向転換する
+    jit: コンパイル済みカーネルを使用するかどうか（Noneで自動選択）
+    setting: 設定（Noneの場合は"setting"セクションを読み込む）
+    block_size: 一度に進めるステップ数（記録用の一時配列の大きさ）
+    seed: 乱数のシード（int, SeedSequence または Generator，
+          Noneの場合はOSのエントロピーから初期化する）
+    method: 積分法（"euler", "rk4", "exponential_euler", "adaptive"，
+            "adaptive"はNumPyによる実装のみ）
+            "rk4", "exponential_euler"は感覚ニューロンの窓を時間で扱うので，
+            dtを大きくしても窓の長さは変わらない
+            "adaptive"の場合は刻み幅を調整しながら進め，dtは記録の間隔として使う
+    tolerance: "adaptive"の1ステップあたりの誤差の許容値（adaptive_runを参照）
+    max_dt: "adaptive"の刻み幅の上限（Noneの場合はニューロンの時定数tau）
+    dtype: 状態，重み，濃度の履歴および記録の型（np.float32で多数のワームを
+           まとめて計算する際のメモリの転送量を半分にする，"adaptive"はfloat64のみ）
+
+    すべてのklinotaxisの共通のシミュレーション本体
+    n匹のワームを(n, 8)の状態配列としてまとめて進め，
+    各レコーダーの結果をrecordersと同じ順に返す
+    """
+    if method not in INTEGRATORS and method != "adaptive":
+        raise ValueError(f"unknown method: {method}")
+    dtype = np.dtype(dtype)
+    if method == "adaptive" and dtype != np.float64:
+        raise ValueError("adaptive method supports float64 only")
+    genes = np.asarray(genes, dtype=float)
+    mu_0 = np.asarray(mu_0, dtype=float)
+    n = max(len(np.atleast_2d(genes)), mu_0.size)
 
     # tomlファイルの読み込み
-    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = constant(
-        "setting_animation"
+    if setting is None:
+        setting = constant("setting")
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+
+    # 遺伝子の値をスケーリング
+    N, M, theta, w_on, w_off, w, a, w_osc, w_nmj = batch_weight(genes, decimal_places)
+    weights = (
+        N,
+        M,
+        *[
+            np.asarray(var, dtype=dtype)
+            for var in [theta, w_on, w_off, w, a, w_osc, w_nmj]
+        ],
     )
 
     # 時間に関する定数をステップ数に変換
-    N_, M_, f_inv, T_ = time_constant_step(gene, "setting_animation", None)
+    N_ = np.floor(N / dt).astype(int)
+    M_ = np.floor(M / dt).astype(int)
+    f_inv = int(np.floor(1 / f / dt)) if pirouette else 0
 
     # 各種配列の初期化
     t = np.arange(0, time, dt)
-    c_t = np.zeros(N_ + M_)
-    if c_mode == 0:
-        c_t[0 : N_ + M_] = c_(alpha, 0, 0, x_peak, y_peak)
-    elif c_mode == 1:
-        c_t[0 : N_ + M_] = c_gauss(c_0, lambda_, 0, 0, x_peak, y_peak)
-    elif c_mode == 2:
-        c_t[0 : N_ + M_] = c_two_gauss(c_0, lambda_, 0, 0, x_peak, y_peak)
-    y = np.zeros((8, len(t)))
-    y[4:8, 0] = np.random.rand(4)  # 運動ニューロンの活性を0～1の範囲でランダム化
-    phi = np.zeros(len(t))
-    mu = np.zeros(len(t))
-    mu[0] = mu_0
-    r = np.zeros((2, len(t)))
-
-    # オイラー法
-    for k in range(len(t) - 1):
-        # シナプス結合およびギャップ結合からの入力
-        synapse = np.dot(w.T, sigmoid(y[:, k] + theta))
-        gap = np.array([np.dot(g[:, i], (y[:, k] - y[i, k])) for i in range(8)])
-
-        # 濃度の更新
-        c_t = np.delete(c_t, 0)
-        if c_mode == 0:
-            c = c_(alpha, r[0, k], r[1, k], x_peak, y_peak)
-        elif c_mode == 1:
-            c = c_gauss(c_0, lambda_, r[0, k], r[1, k], x_peak, y_peak)
-        elif c_mode == 2:
-            c = c_two_gauss(c_0, lambda_, r[0, k], r[1, k], x_peak, y_peak)
-        c_t = np.append(c_t, c)
-
-        # 介在ニューロンおよび運動ニューロンの膜電位の更新
-        y[:, k + 1] = (
-            y[:, k]
-            + (
-                -y[:, k]
-                + synapse
-                + gap
-                + w_on * y_on(c_t, N_, M_, N, M, dt)
-                + w_off * y_off(c_t, N_, M_, N, M, dt)
-                + w_osc * y_osc(t[k], T)
+    y = np.zeros((n, 8), dtype=dtype)
+    rng = np.random.default_rng(seed)
+    y[:, 4:8] = rng.uniform(
+        0, 1, (n, 4)
+    )  # 運動ニューロンの活性を0～1の範囲でランダム化
+    mu = np.array(np.broadcast_to(mu_0, n), dtype=dtype)
+    r = np.zeros((n, 2), dtype=dtype)
+    needs = {recorder.needs for recorder in recorders}
+    for recorder in recorders:
+        recorder.start(n, len(t), setting)
+
+    if method == "adaptive":
+        adaptive_run(
+            y,
+            r,
+            mu,
+            weights,
+            c_mode,
+            setting,
+            t,
+            f_inv,
+            rng,
+            recorders,
+            block_size,
+            tolerance,
+            max_dt,
+        )
+        return tuple(recorder.result() for recorder in recorders)
+
+    # ブロックごとに進め，各レコーダーに渡す
+    c_init = np.full(n, concentration(c_mode, setting, 0, 0))
+    if method == "euler":
+        history = SensoryHistory(c_init, N_, M_, N, M, dt, dtype)
+    else:
+        # 高次の積分法は各段の時刻で感覚ニューロンの入力を求めるので，窓を時間で扱う
+        history = GridSensoryHistory(c_init, N, M, dt)
+    step = KERNELS[method] if use_jit(jit) else INTEGRATORS[method]
+    for k_0 in range(0, len(t), block_size):
+        n_steps = min(block_size, len(t) - k_0)
+        r_out = np.empty((n, 2, n_steps if "r" in needs else 0), dtype=dtype)
+        y_out = np.empty((n, 8, n_steps if "y" in needs else 0), dtype=dtype)
+
+        n_events = 0
+        if f_inv > 0:
+            n_events = np.count_nonzero(
+                np.arange(k_0, k_0 + n_steps) % f_inv == f_inv - 1
             )
-            / tau
-            * dt
+        pirouette_mu = rng.uniform(0, 2 * np.pi, (n, n_events))
+
+        step(
+            y,
+            r,
+            mu,
+            history,
+            k_0,
+            n_steps,
+            t,
+            weights,
+            c_mode,
+            setting,
+            f_inv,
+            pirouette_mu,
+            r_out,
+            y_out,
         )
 
-        # 方向の更新
-        phi[k] = w_nmj * (
-            sigmoid(y[5, k] + theta[5])
-            + sigmoid(y[6, k] + theta[6])
-            - sigmoid(y[4, k] + theta[4])
-            - sigmoid(y[7, k] + theta[7])
-        )
-        mu[k + 1] = mu[k] + phi[k] * dt
+        for recorder in recorders:
+            recorder.record(k_0, r_out, y_out)
+
+    return tuple(recorder.result() for recorder in recorders)
+
+
+def klinotaxis(
+    gene,
+    mu_0,
+    c_mode,
+    decimal_places=None,
+    jit=None,
+    setting=None,
+    stride=1,
+    seed=None,
+    method="euler",
+    dtype=np.float64,
+):
+    (r,) = simulate(
+        gene,
+        mu_0,
+        c_mode,
+        [PositionRecorder(stride)],
+        decimal_places,
+        jit=jit,
+        setting=setting,
+        seed=seed,
+        method=method,
+        dtype=dtype,
+    )
+    return r[0]
+
+
+def klinotaxis_random(gene, jit=None, setting=None, seed=None):
+    rng = np.random.default_rng(seed)
+    (r,) = simulate(
+        gene,
+        rng.uniform(0, 2 * np.pi),  # ランダムな向きで配置
+        0,
+        [PositionRecorder()],
+        pirouette=True,
+        jit=jit,
+        setting=setting,
+        seed=rng,
+    )
+    return r[0]
+
+
+def klinotaxis_membrane_potential(
+    gene, mu_0, c_mode, jit=None, setting=None, seed=None
+):
+    r, y = simulate(
+        gene,
+        mu_0,
+        c_mode,
+        [PositionRecorder(), MembranePotentialRecorder()],
+        jit=jit,
+        setting=setting,
+        seed=seed,
+    )
+    return r[0], y[0]
 
-        # 位置の更新
-        r[0, k + 1], r[1, k + 1] = (
-            r[0, k] + v * np.cos(mu[k]) * dt,
-            r[1, k] + v * np.sin(mu[k]) * dt,
-        )
 
-    return r
+def klinotaxis_animation(
+    gene, mu_0, c_mode, jit=None, setting=None, stride=1, seed=None
+):
+    if setting is None:
+        setting = constant("setting_animation")
+    return klinotaxis(
+        gene, mu_0, c_mode, jit=jit, setting=setting, stride=stride, seed=seed
+    )
 
 
-def ci(r):
-    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = constant("setting")
-    ci = (
-        1
-        - np.sum(np.sqrt((r[0, :] - x_peak) ** 2 + (r[1, :] - y_peak) ** 2))
-        / np.sqrt(x_peak**2 + y_peak**2)
-        / time
-        * dt
+def klinotaxis_batch(
+    genes,
+    mu_0,
+    c_mode,
+    decimal_places=None,
+    setting=None,
+    jit=None,
+    method="euler",
+    dtype=np.float64,
+    seed=None,
+):
+    """
+    genes: 遺伝子 (22,) または ワームごとの遺伝子 (n, 22)
+    mu_0: 初期角度 (スカラー または (n,))
+    c_mode: 濃度関数の種類 (0: 線形, 1: ガウス, 2: 2つのガウス)
+    decimal_places: パラメータを丸める小数点以下の桁数
+    method: 積分法（simulateを参照）
+    dtype: 計算と軌跡の型（simulateを参照）
+    seed: 乱数のシード（int, SeedSequence または Generator）
+
+    n匹のワームをまとめて計算し，klinotaxisと同じ軌跡を(n, 2, len(t))の配列で返す
+    """
+    (r,) = simulate(
+        genes,
+        mu_0,
+        c_mode,
+        [PositionRecorder()],
+        decimal_places,
+        jit=jit,
+        setting=setting,
+        method=method,
+        dtype=dtype,
+        seed=seed,
     )
+    return r
+
+
+def klinotaxis_store(
+    dir_path,
+    genes,
+    mu_0,
+    c_mode,
+    membrane_potential=False,
+    stride=1,
+    setting=None,
+    seed=None,
+    batch_size=100,
+    jit=None,
+    dtype=np.float64,
+):
+    """
+    dir_path: 保存先のディレクトリ
+    genes: 遺伝子 (22,) または ワームごとの遺伝子 (n, 22)
+    mu_0: 初期角度 (スカラー または (n,))
+    c_mode: 濃度関数の種類
+    membrane_potential: 膜電位も保存するかどうか
+    stride: 記録の間隔
+    setting: 設定（Noneの場合は"setting"セクションを読み込む）
+    seed: 乱数のシード
+    batch_size: 一度にまとめて計算するワームの数
+    dtype: 計算と保存の型（simulateを参照）
+
+    n匹の軌跡 r (n, 2, steps)（と膜電位 y (n, 8, steps)）をbatch_size匹ずつ計算し，
+    load.create_storeのバイナリ形式に書き込む（load.load_storeで読み込める）
+    """
+    if setting is None:
+        setting = constant("setting")
+    genes = np.atleast_2d(np.asarray(genes, dtype=float))
+    mu_0 = np.asarray(mu_0, dtype=float)
+    n = max(len(genes), mu_0.size)
+    genes = np.broadcast_to(genes, (n, genes.shape[1]))
+    mu_0 = np.broadcast_to(mu_0, n)
+    steps = -(-len(np.arange(0, setting.time, setting.dt)) // stride)
+
+    arrays = {"r": ((n, 2, steps), dtype)}
+    if membrane_potential:
+        arrays["y"] = ((n, 8, steps), dtype)
+    meta = {
+        "gene": genes.tolist(),
+        "mu_0": mu_0.tolist(),
+        "c_mode": c_mode,
+        "stride": stride,
+        "setting": dict(zip(Setting._fields, setting)),
+    }
+    memmaps = load.create_store(dir_path, arrays, meta)
+
+    starts = range(0, n, batch_size)
+    for i, batch_seed in zip(starts, np.random.SeedSequence(seed).spawn(len(starts))):
+        recorders = [PositionRecorder(stride)]
+        if membrane_potential:
+            recorders.append(MembranePotentialRecorder(stride))
+        results = simulate(
+            genes[i : i + batch_size],
+            mu_0[i : i + batch_size],
+            c_mode,
+            recorders,
+            jit=jit,
+            setting=setting,
+            seed=batch_seed,
+            dtype=dtype,
+        )
+        for memmap, result in zip(memmaps.values(), results):
+            memmap[i : i + batch_size] = result
+    for memmap in memmaps.values():
+        memmap.flush()
+
+
+def peak_distance(r, setting):
+    """
+    r: 軌跡 (2, len(t)) または 複数の軌跡 (n, 2, len(t))
+
+    各時刻の濃度のピークまでの距離
+    """
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    return np.sqrt((r[..., 0, :] - x_peak) ** 2 + (r[..., 1, :] - y_peak) ** 2)
+
+
+def ci_from_distance_sum(distance_sum, setting):
+    """
+    distance_sum: ピークまでの距離の全時刻の和
+    """
+    alpha, x_peak, y_peak, dt, T, f, v, time, tau, c_0, lambda_ = setting
+    ci = 1 - distance_sum / np.sqrt(x_peak**2 + y_peak**2) / time * dt
     ci = np.clip(ci, 0, None)
 
     return ci
 
 
-def calculate_single_ci(args):
-    gene, c_mode = args
-    mu_0 = np.random.uniform(0, 2 * np.pi)
-    r = klinotaxis(gene, mu_0, c_mode)
-    return ci(r)
+def ci(r, setting=None):
+    """
+    r: 軌跡 (2, len(t)) または 複数の軌跡 (n, 2, len(t))
+    setting: 設定（Noneの場合は"setting"セクションを読み込む）
+    """
+    if setting is None:
+        setting = constant("setting")
+    return ci_from_distance_sum(np.sum(peak_distance(r, setting), axis=-1), setting)
 
 
-def calculate_ci(gene, c_mode, average_number):
-    process = multiprocessing.cpu_count()
-    with multiprocessing.Pool(process) as pool:
-        args_list = [(gene, c_mode) for _ in range(average_number)]
-        results = pool.map(calculate_single_ci, args_list)
+def calculate_single_ci(args):
+    # seed: ワームごとにSeedSequenceから分岐させたシード（ワーカー間で乱数が重複しない）
+    gene, c_mode, setting, seed = args
+    rng = np.random.default_rng(seed)
+    mu_0 = rng.uniform(0, 2 * np.pi)
+    (ci_,) = simulate(gene, mu_0, c_mode, [CIRecorder()], setting=setting, seed=rng)
+    return ci_[0]
+
+
+class RunningCI:
+    """
+    CIの平均と分散をWelford法で逐次計算する
+
+    count: これまでに追加したワームの数
+    mean: 平均
+    std: 標準偏差（np.stdと同じく ddof=0）
+    se: 平均の標準誤差（不偏分散から計算）
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count > 0 else math.nan
+
+    @property
+    def se(self):
+        if self.count < 2:
+            return math.inf
+        return math.sqrt(self.m2 / (self.count - 1) / self.count)
+
+    def interval(self, z=1.96):
+        """
+        z: 信頼区間の幅（1.96で95%信頼区間）
+        """
+        return self.mean - z * self.se, self.mean + z * self.se
+
+
+def calculate_ci_sequential(
+    gene,
+    c_mode,
+    max_number,
+    target_se=None,
+    min_number=10,
+    z=1.96,
+    verbose=False,
+    seed=None,
+):
+    """
+    gene: 遺伝子
+    c_mode: 濃度関数の種類
+    max_number: 計算するワームの最大数
+    target_se: 目標とする平均の標準誤差（Noneの場合はmax_number匹すべて計算する）
+    min_number: 打ち切りを判定し始めるワームの数
+    z: 表示する信頼区間の幅（1.96で95%信頼区間）
+    verbose: ワームが計算されるたびに途中経過を表示するかどうか
+    seed: 乱数のシード（指定した場合は打ち切るまでの結果も含めて再現できる）
+
+    ワームの順にCIを集計し，標準誤差がtarget_se以下になった時点で打ち切る
+    RunningCIを返す
+    """
+    # ワーカーがファイルを読まずに済むよう，設定を引数として渡す
+    setting = constant("setting")
+    stats = RunningCI()
+    seeds = np.random.SeedSequence(seed).spawn(max_number)
+    args_list = ((gene, c_mode, setting, seeds[i]) for i in range(max_number))
+    # 投入するタスクの数が制限されているので，打ち切った後に残るのは計算中のワームのみ
+    # 終わった順ではなくワームの順に集計するので，打ち切る位置もシードで決まる
+    for value in executor.imap(calculate_single_ci, args_list):
+        stats.update(value)
+        if verbose:
+            lower, upper = stats.interval(z)
+            print(
+                f"{stats.count}: CI = {stats.mean:.4f} "
+                f"[{lower:.4f}, {upper:.4f}] (SE = {stats.se:.4f})"
+            )
+        if (
+            target_se is not None
+            and stats.count >= min_number
+            and stats.se <= target_se
+        ):
+            break
+
+    return stats
+
+
+def calculate_ci(gene, c_mode, average_number, target_se=None, seed=None):
+    """
+    gene: 遺伝子
+    c_mode: 濃度関数の種類
+    average_number: 平均をとるワームの数（target_seを指定した場合は最大数）
+    target_se: 目標とする平均の標準誤差（指定した場合は途中で打ち切る）
+    seed: 乱数のシード
+
+    CIの平均と標準偏差を返す
+    """
+    stats = calculate_ci_sequential(gene, c_mode, average_number, target_se, seed=seed)
+
+    return stats.mean, stats.std
+
+
+def calculate_ci_batch(
+    gene,
+    c_mode,
+    average_number,
+    batch_size=1000,
+    seed=None,
+    setting=None,
+    method="euler",
+    dtype=np.float64,
+):
+    """
+    gene: 遺伝子
+    c_mode: 濃度関数の種類
+    average_number: 平均をとるワームの数
+    batch_size: 一度にまとめて計算するワームの数
+    seed: 乱数のシード
+    setting: 設定（Noneの場合は"setting"セクションを読み込む，
+             粗い時間刻みで計算する場合は dt を変更したものを渡す）
+    method: 積分法（simulateを参照）
+    dtype: 計算の型（simulateを参照）
+
+    ワームをまとめて計算し，CIの平均と標準偏差を返す
+    軌跡は保存せずCIRecorderで逐次計算する
+    """
+    if setting is None:
+        setting = constant("setting")
+    starts = range(0, average_number, batch_size)
+    angle_seed, *batch_seeds = np.random.SeedSequence(seed).spawn(1 + len(starts))
+    mu_0 = np.random.default_rng(angle_seed).uniform(0, 2 * np.pi, average_number)
+    results = np.concatenate(
+        [
+            simulate(
+                gene,
+                mu_0[i : i + batch_size],
+                c_mode,
+                [CIRecorder()],
+                setting=setting,
+                seed=batch_seed,
+                method=method,
+                dtype=dtype,
+            )[0]
+            for i, batch_seed in zip(starts, batch_seeds)
+        ]
+    )
 
     mean_value = np.mean(results)
     std_dev = np.std(results)
 
     return mean_value, std_dev
+
+
+def ci_stream(genes, c_mode, n_worms, seed=None):
+    """
+    genes: 遺伝子のリスト
+    c_mode: 濃度関数の種類
+    n_worms: 遺伝子ごとのワームの数
+    seed: 乱数のシード（ワームごとに子シードを分岐させる）
+
+    すべての(遺伝子, ワーム)の組を1つのキューとして共有のプロセスプールで計算し，
+    終わった順に (遺伝子の番号, ワームの番号, CI) を返すジェネレーター
+    """
+    # ワーカーがファイルを読まずに済むよう，設定を引数として渡す
+    setting = constant("setting")
+    seeds = np.random.SeedSequence(seed).spawn(len(genes) * n_worms)
+    args_list = (
+        (genes[i // n_worms], c_mode, setting, seeds[i])
+        for i in range(len(genes) * n_worms)
+    )
+    for i, value in executor.imap_indexed(calculate_single_ci, args_list):
+        yield i // n_worms, i % n_worms, value
+
+
+def evaluate_population(path, c_mode, n_worms, out_path=None, seed=None):
+    """
+    path: 遺伝子が保存されているJSONファイルのパス（Result.jsonなど）
+    c_mode: 濃度関数の種類
+    n_worms: 遺伝子ごとに平均をとるワームの数
+    out_path: CIの表を書き出すファイルのパス（Noneの場合は書き出さない）
+    seed: 乱数のシード
+
+    JSONを1度だけ読み込み，すべての(遺伝子, ワーム)の組を1つのキューで並列に計算する
+    CIの平均の大きい順に並べた表（辞書のリスト）を返す
+    表は「順位, 遺伝子の番号, value, CIの平均, CIの標準偏差, 標準誤差」の列で書き出す
+    """
+    result = load.load_result_json(path)
+    stats = [RunningCI() for _ in result]
+    genes = [gene_result["gene"] for gene_result in result]
+    for i, worm, value in ci_stream(genes, c_mode, n_worms, seed):
+        stats[i].update(value)
+
+    order = sorted(range(len(result)), key=lambda i: stats[i].mean, reverse=True)
+    table = [
+        {
+            "rank": rank,
+            "index": i,
+            "value": result[i].get("value"),
+            "mean": stats[i].mean,
+            "std": stats[i].std,
+            "se": stats[i].se,
+        }
+        for rank, i in enumerate(order, 1)
+    ]
+
+    if out_path is not None:
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        with open(out_path, "w") as txt_file:
+            txt_file.write("# rank, index, value, ci_mean, ci_std, ci_se\n")
+            for row in table:
+                txt_file.write(
+                    f"{row['rank']}, {row['index']}, {row['value']}, "
+                    f"{row['mean']}, {row['std']}, {row['se']}\n"
+                )
+
+    return table
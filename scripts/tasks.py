@@ -0,0 +1,34 @@
+from scripts import cache
+
+# プロセスプールで実行するタスク
+# ワーカーがmatplotlibなどの描画用モジュールを読み込まずに済むよう，figureやanimationとは分けて置く
+# 共有メモリ（executor.SharedArray）は同じチャンクの他のタスクも使うので，タスク内では閉じない
+
+
+def calculate_trajectory(gene_angle_list):
+    gene, angle, c_mode, decimal_places, setting, seed, shared, index = gene_angle_list
+    # 結果は共有メモリに書き込み，親プロセスにはインデックスだけを返す
+    shared.array[index] = cache.klinotaxis(
+        gene, angle, c_mode, decimal_places, setting, seed
+    )
+    return index
+
+
+def calculate_trajectory_membrane_potential(gene_angle_list):
+    gene, angle, c_mode, setting, seed, shared, index = gene_angle_list
+
+    r, y = cache.klinotaxis_membrane_potential(gene, angle, c_mode, setting, seed)
+
+    # x, y, AIY, AIZ の順に共有メモリに書き込み，親プロセスにはインデックスだけを返す
+    shared.array[index, 0:2] = r
+    shared.array[index, 2] = (y[0] + y[1]) / 2
+    shared.array[index, 3] = (y[2] + y[3]) / 2
+
+    return index
+
+
+def calculate_animation_trajectory(gene_angle_list):
+    gene, angle, c_mode, setting, downsample_factor, seed = gene_angle_list
+    return cache.klinotaxis(
+        gene, angle, c_mode, setting=setting, seed=seed, stride=downsample_factor
+    )